@@ -1,10 +1,38 @@
-from flask import Flask, render_template, request, jsonify, session, redirect
+from flask import Flask, Request, render_template, request, jsonify, session, redirect
 from flask_cors import CORS
+import asyncio
+import codecs
+import concurrent.futures
+import contextlib
+import contextvars
+import copy
+import functools
+import hashlib
+import html
+import io
 import json
+import math
+import mmap
 import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
 import uuid
+from bisect import bisect_left, insort
+from collections import defaultdict, deque
+import heapq
 from datetime import datetime
-import requests
+import httpx
+import numpy as np
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # PDF uploads are optional
+    PdfReader = None
 
 app = Flask(__name__, template_folder='templates')
 app.secret_key = 'study-companion-secret-key-2024-change-this'
@@ -21,43 +49,194 @@ CORS(app, supports_credentials=True)  # Enable credentials for CORS
 
 # Groq API Configuration
 GROQ_API_KEY = os.environ.get("GROQ_API_KEY", "")
-GROQ_URL = "https://api.groq.com/openai/v1/chat/completions"
+GROQ_URL = os.environ.get("GROQ_URL", "https://api.groq.com/openai/v1/chat/completions")
+GROQ_MAX_IN_FLIGHT = int(os.environ.get("GROQ_MAX_IN_FLIGHT", 500))
 
-def call_groq(prompt, system_message=None, max_tokens=1000, temperature=0.5):
-    """Call Groq API with improved parameters"""
+# Circuit breaker: once recent calls are mostly slow or failing, skip Groq and
+# let callers serve their local fallback until a probe call succeeds again
+LLM_SLO_SECONDS = float(os.environ.get("LLM_SLO_SECONDS", 10))
+# A call this far past the SLO is abandoned, failing fast and counting as bad
+GROQ_TIMEOUT_SLO_MULTIPLE = 2
+GROQ_TIMEOUT = LLM_SLO_SECONDS * GROQ_TIMEOUT_SLO_MULTIPLE
+LLM_BREAKER_WINDOW = 20
+LLM_BREAKER_MIN_CALLS = 5
+LLM_BREAKER_BAD_RATE = 0.5
+LLM_BREAKER_OPEN_SECONDS = int(os.environ.get("LLM_BREAKER_OPEN_SECONDS", 30))
+LLM_BREAKER_PROBES = 2  # consecutive good probes needed to close again
+
+class CircuitBreaker:
+    """Closed -> open on a breached SLO -> half-open probes -> closed"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.state = 'closed'
+        self.recent = deque(maxlen=LLM_BREAKER_WINDOW)  # (ok, latency) per call
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.probe_successes = 0
+        self.skipped = 0
+
+    def allow(self):
+        """Whether a call may go out now; half-open lets one probe through at a time"""
+        with self.lock:
+            if self.state == 'open' and time.time() - self.opened_at >= LLM_BREAKER_OPEN_SECONDS:
+                self.state = 'half_open'
+                self.probe_successes = 0
+            if self.state == 'closed':
+                return True
+            if self.state == 'half_open' and not self.probe_in_flight:
+                self.probe_in_flight = True
+                return True
+            self.skipped += 1
+            return False
+
+    def open(self):
+        self.state = 'open'
+        self.opened_at = time.time()
+        self.recent.clear()
+        print(f"LLM circuit opened for {LLM_BREAKER_OPEN_SECONDS}s, serving local fallbacks")
+
+    def record(self, ok, latency):
+        """Report a finished call; ok is None when the call was cancelled"""
+        with self.lock:
+            if self.state == 'half_open':
+                self.probe_in_flight = False
+                if ok is None:
+                    return
+                if not ok or latency > LLM_SLO_SECONDS:
+                    self.open()
+                    return
+                self.probe_successes += 1
+                if self.probe_successes >= LLM_BREAKER_PROBES:
+                    self.state = 'closed'
+                    print("LLM circuit closed")
+                return
+            if ok is None or self.state != 'closed':
+                return
+            
+            self.recent.append((ok, latency))
+            bad = sum(1 for ok, latency in self.recent if not ok or latency > LLM_SLO_SECONDS)
+            if len(self.recent) >= LLM_BREAKER_MIN_CALLS and bad >= LLM_BREAKER_BAD_RATE * len(self.recent):
+                self.open()
+
+    def snapshot(self):
+        with self.lock:
+            latencies = sorted(latency for ok, latency in self.recent)
+            return {
+                'state': self.state,
+                'recent_calls': len(self.recent),
+                'recent_errors': sum(1 for ok, latency in self.recent if not ok),
+                'p50_latency': round(latencies[len(latencies) // 2], 3) if latencies else None,
+                'slo_seconds': LLM_SLO_SECONDS,
+                'skipped_calls': self.skipped,
+                'retry_in': max(0, round(self.opened_at + LLM_BREAKER_OPEN_SECONDS - time.time(), 1)) if self.state == 'open' else None
+            }
+
+llm_breaker = CircuitBreaker()
+
+# Every request thread hands its Groq calls to one event loop, so in-flight
+# calls share a connection pool instead of each blocking its own socket. The
+# views stay synchronous: each HTTP request waits on its own server thread,
+# so concurrent LLM requests per process are bounded by the server's threads
+# (see benchmarks/llm_load_test.py).
+llm_loop = asyncio.new_event_loop()
+threading.Thread(target=llm_loop.run_forever, name='llm-loop', daemon=True).start()
+llm_client = None  # created lazily on llm_loop
+
+async def groq_post(data):
+    """POST a chat completion on llm_loop and return the reply text or None"""
+    global llm_client
+    if llm_client is None:
+        llm_client = httpx.AsyncClient(
+            timeout=GROQ_TIMEOUT,
+            limits=httpx.Limits(max_connections=GROQ_MAX_IN_FLIGHT, max_keepalive_connections=100)
+        )
+    
+    if not llm_breaker.allow():
+        return None
+    
+    started = time.monotonic()
+    reply = None
+    ok = None
     try:
-        headers = {
-            "Authorization": f"Bearer {GROQ_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
-        messages = []
-        if system_message:
-            messages.append({"role": "system", "content": system_message})
-        messages.append({"role": "user", "content": prompt})
-        
-        data = {
-            "model": "llama-3.3-70b-versatile",
-            "messages": messages,
-            "temperature": temperature,
-            "max_tokens": max_tokens,
-            "top_p": 0.9,
-            "frequency_penalty": 0.3,
-            "presence_penalty": 0.3
-        }
-        
-        response = requests.post(GROQ_URL, headers=headers, json=data, timeout=30)
+        headers = {"Content-Type": "application/json"}
+        if GROQ_API_KEY:
+            headers["Authorization"] = f"Bearer {GROQ_API_KEY}"
+        # httpx timeouts are per read; the deadline covers the whole call
+        response = await asyncio.wait_for(llm_client.post(GROQ_URL, headers=headers, json=data), GROQ_TIMEOUT)
         
         if response.status_code == 200:
             result = response.json()
-            return result["choices"][0]["message"]["content"]
+            reply = result["choices"][0]["message"]["content"]
         else:
             print(f"Groq API Error: {response.status_code}, Response: {response.text}")
-            return None
+        ok = reply is not None
             
+    except asyncio.TimeoutError:
+        print(f"Groq request timed out after {GROQ_TIMEOUT:g}s")
+        ok = False
     except Exception as e:
         print(f"Groq request failed: {str(e)}")
-        return None
+        ok = False
+    finally:
+        llm_breaker.record(ok, time.monotonic() - started)
+    return reply
+
+def groq_payload(prompt, system_message, max_tokens, temperature):
+    messages = []
+    if system_message:
+        messages.append({"role": "system", "content": system_message})
+    messages.append({"role": "user", "content": prompt})
+    
+    return {
+        "model": "llama-3.3-70b-versatile",
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "top_p": 0.9,
+        "frequency_penalty": 0.3,
+        "presence_penalty": 0.3
+    }
+
+# Background work (see PREFETCH) holds its calls back while this many
+# interactive calls are already in flight
+LLM_BUSY_THRESHOLD = int(os.environ.get("LLM_BUSY_THRESHOLD", 8))
+background_job = contextvars.ContextVar('background_job', default=None)
+interactive_llm_calls = 0
+interactive_llm_lock = threading.Lock()
+
+@contextlib.contextmanager
+def llm_call_slot(calls=1):
+    """Count interactive calls, or hold background work back while users are waiting"""
+    global interactive_llm_calls
+    job = background_job.get()
+    if job is not None:
+        # Yield to interactive requests unless a user is already waiting on this job
+        while not job['waiters'] and interactive_llm_calls >= LLM_BUSY_THRESHOLD:
+            time.sleep(0.2)
+        yield
+        return
+    
+    with interactive_llm_lock:
+        interactive_llm_calls += calls
+    try:
+        yield
+    finally:
+        with interactive_llm_lock:
+            interactive_llm_calls -= calls
+
+def call_groq_many(calls):
+    """Run (prompt, system_message, max_tokens, temperature) calls concurrently on llm_loop"""
+    with llm_call_slot(len(calls)):
+        futures = [
+            asyncio.run_coroutine_threadsafe(groq_post(groq_payload(*call)), llm_loop)
+            for call in calls
+        ]
+        return [future.result() for future in futures]
+
+def call_groq(prompt, system_message=None, max_tokens=1000, temperature=0.5):
+    """Call Groq API with improved parameters"""
+    return call_groq_many([(prompt, system_message, max_tokens, temperature)])[0]
 
 # Initialize database
 users_db = {
@@ -76,12 +255,1773 @@ users_db = {
 }
 
 study_materials_db = {"demo-user-12345": [], "test-user-67890": []}
-flashcards_db = {"demo-user-12345": [], "test-user-67890": []}
+flashcards_db = {"demo-user-12345": {}, "test-user-67890": {}}  # user_id -> deck id -> Deck
 exams_db = {"demo-user-12345": [], "test-user-67890": []}
 active_exams = {}
+lecture_sessions = {}
+
+# ==================== RECORDS ====================
+# Stored materials, flashcards and exam questions are slotted records instead
+# of dicts: uuids as 16 raw bytes, timestamps as epoch seconds and repeated
+# labels interned. to_json() restores the original shape for the API.
+
+def pack_id(value):
+    """16-byte form of a canonical uuid string; any other id stays an interned string"""
+    if not isinstance(value, str):
+        return value
+    try:
+        packed = uuid.UUID(value)
+    except ValueError:
+        return sys.intern(value)
+    return packed.bytes if str(packed) == value else sys.intern(value)
+
+def unpack_id(value):
+    return str(uuid.UUID(bytes=value)) if isinstance(value, bytes) else value
+
+def pack_time(value):
+    try:
+        return int(datetime.fromisoformat(value).timestamp())
+    except (TypeError, ValueError):
+        return value
+
+def unpack_time(value):
+    return datetime.fromtimestamp(value).isoformat() if isinstance(value, int) else value
+
+def intern_label(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+class Record:
+    """Slotted replacement for a stored JSON object; unknown keys go to extra"""
+    __slots__ = ('extra',)
+    ids = ()
+    times = ()
+    labels = ()
+
+    @classmethod
+    def from_json(cls, data):
+        record = cls.__new__(cls)
+        record.extra = None
+        for key, value in data.items():
+            if key not in cls.__slots__:
+                if record.extra is None:
+                    record.extra = {}
+                record.extra[key] = value
+                continue
+            if key in cls.ids:
+                value = pack_id(value)
+            elif key in cls.times:
+                value = pack_time(value)
+            elif key in cls.labels:
+                value = intern_label(value)
+            elif isinstance(value, list):
+                value = tuple(value)
+            setattr(record, key, value)
+        return record
+
+    def to_json(self, fields=None):
+        """The original JSON object, or only the requested fields of it"""
+        data = {}
+        for key in self.__slots__:
+            if fields is not None and key not in fields or not hasattr(self, key):
+                continue
+            value = getattr(self, key)
+            if key in self.ids:
+                value = unpack_id(value)
+            elif key in self.times:
+                value = unpack_time(value)
+            elif isinstance(value, tuple):
+                value = list(value)
+            data[key] = value
+        if self.extra:
+            data.update(self.extra if fields is None else {k: v for k, v in self.extra.items() if k in fields})
+        return data
+
+    def summary_json(self):
+        return self.to_json()
+
+    def view_json(self, view='full', fields=None):
+        if fields is not None:
+            return self.to_json(fields)
+        return self.summary_json() if view == 'summary' else self.to_json()
+
+class Material(Record):
+    __slots__ = ('id', 'type', 'topic', 'content', 'created_at', 'length', 'source')
+    ids = ('id',)
+    times = ('created_at',)
+    labels = ('type', 'topic', 'source')
+
+    def summary_json(self):
+        """Listing entry: everything but the content, plus a short preview of it"""
+        data = self.to_json(MATERIAL_SUMMARY_FIELDS)
+        data['preview'] = self.content[:MATERIAL_PREVIEW_CHARS] if isinstance(self.content, str) else None
+        return data
+
+class Flashcard(Record):
+    __slots__ = ('id', 'front', 'back', 'category', 'difficulty', 'created_at')
+    ids = ('id',)
+    times = ('created_at',)
+    labels = ('category', 'difficulty')
+
+class Deck(Record):
+    __slots__ = ('id', 'category', 'created_at', 'source', 'cards')
+    ids = ('id',)
+    times = ('created_at',)
+    labels = ('category', 'source')
+
+    def to_json(self, fields=None):
+        data = super().to_json(fields)
+        if 'cards' in data:
+            data['cards'] = [card.to_json() for card in self.cards]
+        return data
+
+    def summary_json(self):
+        """Deck listing entry: metadata plus the first card as a preview"""
+        first = self.cards[0] if self.cards else None
+        return {
+            'id': unpack_id(self.id),
+            'category': self.category,
+            'created_at': unpack_time(self.created_at),
+            'source': getattr(self, 'source', None),
+            'card_count': len(self.cards),
+            'front': first.front if first else None,
+            'back': first.back if first else None
+        }
+
+class Question(Record):
+    __slots__ = ('id', 'question', 'options', 'correct_answer', 'explanation', 'difficulty', 'points', 'question_number')
+    ids = ('id',)
+    labels = ('correct_answer', 'difficulty')
+
+def exam_json(exam, fields=None):
+    """Exam or result record with its questions turned back into JSON"""
+    if fields is not None:
+        exam = {key: value for key, value in exam.items() if key in fields}
+    if 'questions' not in exam:
+        return exam
+    return dict(exam, questions=[q.to_json() if isinstance(q, Record) else q for q in exam['questions']])
+
+def exam_summary_json(exam):
+    """Listing entry: scores and metadata without questions or per-question results"""
+    data = {key: value for key, value in exam.items() if key not in ('questions', 'results')}
+    if 'questions' in exam:
+        data.setdefault('total_questions', len(exam['questions']))
+    return data
+
+def exam_view_json(exam, view='full', fields=None):
+    if fields is not None:
+        return exam_json(exam, fields)
+    return exam_summary_json(exam) if view == 'summary' else exam_json(exam)
+
+# List and detail endpoints take ?view=summary for a light listing shape, or
+# ?fields=a,b,c to pick keys of the full object; full objects are the default.
+RESPONSE_VIEWS = ('full', 'summary')
+MATERIAL_SUMMARY_FIELDS = frozenset(('id', 'type', 'topic', 'created_at', 'length', 'source'))
+MATERIAL_PREVIEW_CHARS = 200
+
+def requested_view(default='full'):
+    """(view, fields) from the query string; view is None when it is not a known view"""
+    view = request.args.get('view', default)
+    fields = {f.strip() for f in request.args.get('fields', '').split(',') if f.strip()} or None
+    return (view if view in RESPONSE_VIEWS else None), fields
+
+# ==================== SEARCH INDEX ====================
+SEARCH_BM25_K1 = 1.2
+SEARCH_BM25_B = 0.75
+SEARCH_MAX_PREFIX_TERMS = 50
+SEARCH_MAX_PREFIX_POSTINGS = 200000  # postings scored across one token's prefix expansions
+SEARCH_COMMON_DF = 0.5               # terms in over half the documents are "common"
+SEARCH_COMMON_MIN_DOCS = 250000      # libraries this large may skip common terms (see search)
+SEARCH_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+def tokenize(text):
+    """Lowercase word tokens used by the search index"""
+    return SEARCH_TOKEN_RE.findall((text or '').lower())
+
+def bm25_idf(n_docs, df):
+    return math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+
+class SearchIndex:
+    """Incremental inverted index with BM25 ranking for one user's material"""
+
+    def __init__(self):
+        self.postings = {}               # term -> {slot: term frequency}
+        self.terms = []                  # sorted vocabulary, for prefix lookups
+        self.doc_lengths = {}            # doc_key -> number of tokens
+        self.doc_terms = {}              # doc_key -> distinct terms (for deletes)
+        self.docs = {}                   # doc_key -> result metadata
+        self.parents = defaultdict(set)  # parent id -> doc_keys (for deletes)
+        self.total_length = 0
+
+        # Columnar copies of queried terms' postings for vectorized scoring:
+        # term -> [slots, tfs, size]; a removed document's tf is zeroed in place
+        self.term_arrays = {}
+        self.slots = {}                  # doc_key -> row in the per-document arrays
+        self.slot_keys = []              # row -> doc_key (None once removed)
+        self.slot_lengths = np.zeros(0, np.float64)
+        self.slot_types = np.zeros(0, np.int8)
+        self.type_codes = {}             # doc_type -> code in slot_types
+
+    def add(self, doc_type, doc_id, text, parent_id=None, **meta):
+        """Index (or re-index) a document"""
+        key = (doc_type, doc_id)
+        if key in self.docs:
+            self._remove_doc(key)
+
+        tokens = tokenize(text)
+        counts = defaultdict(int)
+        for token in tokens:
+            counts[token] += 1
+
+        slot = self._add_slot(key, doc_type, len(tokens))
+        for term, tf in counts.items():
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = {}
+                insort(self.terms, term)
+            posting[slot] = tf
+            arrays = self.term_arrays.get(term)
+            if arrays is not None:
+                slots, tfs, size = arrays
+                if size == len(slots):
+                    slots = arrays[0] = grow_array(slots, 2 * size)
+                    tfs = arrays[1] = grow_array(tfs, 2 * size)
+                slots[size] = slot
+                tfs[size] = tf
+                arrays[2] = size + 1
+
+        parent_id = parent_id or doc_id
+        self.doc_lengths[key] = len(tokens)
+        self.doc_terms[key] = tuple(counts)
+        self.total_length += len(tokens)
+        self.docs[key] = dict(meta, type=doc_type, id=doc_id, parent_id=parent_id)
+        self.parents[parent_id].add(key)
+
+    def remove(self, parent_id):
+        """Remove every document belonging to a material, flashcard or exam"""
+        keys = self.parents.pop(parent_id, set())
+        for key in keys:
+            self._remove_doc(key)
+        return len(keys)
+
+    def discard(self, doc_type, doc_id):
+        """Remove a single document, e.g. one card of a deck"""
+        key = (doc_type, doc_id)
+        if key in self.docs:
+            self._remove_doc(key)
+
+    def _add_slot(self, key, doc_type, length):
+        # Rows are never reused, so a slot appears at most once per term array
+        slot = len(self.slot_keys)
+        if slot == len(self.slot_lengths):
+            capacity = max(1024, 2 * slot)
+            self.slot_lengths = grow_array(self.slot_lengths, capacity)
+            self.slot_types = grow_array(self.slot_types, capacity)
+        self.slot_keys.append(key)
+        self.slots[key] = slot
+        self.slot_lengths[slot] = length
+        self.slot_types[slot] = self.type_codes.setdefault(doc_type, len(self.type_codes))
+        return slot
+
+    def _term_arrays(self, term):
+        arrays = self.term_arrays.get(term)
+        if arrays is None:
+            posting = self.postings[term]
+            slots = np.fromiter(posting, np.int64, len(posting))
+            tfs = np.fromiter(posting.values(), np.float64, len(posting))
+            arrays = self.term_arrays[term] = [slots, tfs, len(posting)]
+        return arrays
+
+    def _remove_doc(self, key):
+        meta = self.docs.pop(key)
+        siblings = self.parents.get(meta['parent_id'])
+        if siblings is not None:
+            siblings.discard(key)
+            if not siblings:
+                del self.parents[meta['parent_id']]
+
+        self.total_length -= self.doc_lengths.pop(key)
+        slot = self.slots.pop(key)
+        self.slot_keys[slot] = None
+        for term in self.doc_terms.pop(key):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            posting.pop(slot, None)
+            arrays = self.term_arrays.get(term)
+            if arrays is not None:
+                slots, tfs, size = arrays
+                tfs[np.flatnonzero(slots[:size] == slot)] = 0
+                # Drop the columnar copy once it is mostly removed documents
+                if size > 2 * len(posting) + 64:
+                    del self.term_arrays[term]
+            if not posting:
+                self.term_arrays.pop(term, None)
+                del self.postings[term]
+                i = bisect_left(self.terms, term)
+                if i < len(self.terms) and self.terms[i] == term:
+                    del self.terms[i]
+
+    def expand(self, token):
+        """Vocabulary terms starting with token (exact match first)"""
+        i = bisect_left(self.terms, token)
+        matches = []
+        while i < len(self.terms) and len(matches) < SEARCH_MAX_PREFIX_TERMS:
+            term = self.terms[i]
+            if not term.startswith(token):
+                break
+            matches.append(term)
+            i += 1
+        return matches
+
+    def search(self, query, limit=20, doc_types=None):
+        """Return the top documents for query ranked by BM25
+
+        Postings are scored as numpy columns and the top results picked with
+        argpartition. In libraries of SEARCH_COMMON_MIN_DOCS or more, terms found
+        in over half the documents are skipped once the query's rarer words
+        alone fill the results; smaller libraries always score every term.
+        Prefix expansions are scored most frequent first until
+        SEARCH_MAX_PREFIX_POSTINGS is spent.
+        """
+        n_docs = len(self.docs)
+        if not n_docs:
+            return []
+
+        avg_length = self.total_length / n_docs or 1
+        common_df = SEARCH_COMMON_DF * n_docs
+        weighted = []   # (weight, term, common)
+        has_rare_word = False
+        for token in set(tokenize(query)):
+            exact = self.postings.get(token)
+            if exact is not None:
+                weighted.append((bm25_idf(n_docs, len(exact)), token, len(exact) > common_df))
+                has_rare_word = has_rare_word or len(exact) <= common_df
+
+            expansions = sorted(
+                ((len(self.postings[term]), term) for term in self.expand(token) if term != token),
+                reverse=True
+            )
+            budget = SEARCH_MAX_PREFIX_POSTINGS
+            for i, (df, term) in enumerate(expansions):
+                if i and df > budget:
+                    break
+                budget -= df
+                # Prefix expansions rank below an exact word match
+                weighted.append((bm25_idf(n_docs, df) * 0.5, term, df > common_df))
+
+        if not weighted:
+            return []
+
+        n_slots = len(self.slot_keys)
+        lengths = self.slot_lengths[:n_slots]
+        norm_base = SEARCH_BM25_K1 * (1 - SEARCH_BM25_B)
+        norm_per_token = SEARCH_BM25_K1 * SEARCH_BM25_B / avg_length
+        scores = np.zeros(n_slots)
+
+        def score_terms(terms):
+            for weight, term, _common in terms:
+                slots, tfs, size = self._term_arrays(term)
+                slots, tfs = slots[:size], tfs[:size]
+                scores[slots] += weight * (SEARCH_BM25_K1 + 1) * tfs / (tfs + norm_base + norm_per_token * lengths[slots])
+
+        # Rarer terms first: common terms are only skipped when those already
+        # match enough documents, so nothing that matches the query is dropped
+        # from a result list that would otherwise come up short
+        score_terms([item for item in weighted if not item[2]])
+        if doc_types:
+            codes = [self.type_codes[t] for t in doc_types if t in self.type_codes]
+            scores[~np.isin(self.slot_types[:n_slots], codes)] = 0
+        common = [item for item in weighted if item[2]]
+        skip_common = n_docs >= SEARCH_COMMON_MIN_DOCS and has_rare_word and np.count_nonzero(scores) >= limit
+        if common and not skip_common:
+            score_terms(common)
+            if doc_types:
+                scores[~np.isin(self.slot_types[:n_slots], codes)] = 0
+
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(scores[candidates], -limit)[-limit:]]
+        ranked = candidates[np.argsort(-scores[candidates], kind='stable')]
+
+        results = []
+        for slot in ranked:
+            result = dict(self.docs[self.slot_keys[slot]])
+            result['score'] = round(float(scores[slot]), 4)
+            results.append(result)
+        return results
+
+search_indexes = defaultdict(SearchIndex)
+
+def index_summary(user_id, material):
+    search_indexes[user_id].add(
+        'summary', unpack_id(material.id), f"{material.topic} {material.content}",
+        title=material.topic, created_at=unpack_time(material.created_at)
+    )
+
+def index_flashcards(user_id, deck):
+    index = search_indexes[user_id]
+    deck_id = unpack_id(deck.id)
+    for card in deck.cards:
+        index.add(
+            'flashcard', unpack_id(card.id), f"{card.front} {card.back}", parent_id=deck_id,
+            title=card.front, snippet=card.back[:150], category=card.category, deck_id=deck_id
+        )
+
+def index_exam_questions(user_id, exam_id, exam_type, questions):
+    index = search_indexes[user_id]
+    for q in questions:
+        index.add(
+            'exam_question', f"{exam_id}:{unpack_id(q.id)}", q.question, parent_id=exam_id,
+            title=q.question, exam_id=exam_id, exam_type=exam_type
+        )
+
+# ==================== NEAR-DUPLICATE DETECTION ====================
+SIMHASH_BITS = 64
+SIMHASH_BANDS = 4                # 4 bands of 16 bits: any match within 3 bits shares a band
+NEAR_DUPLICATE_MAX_DISTANCE = 3
+NEAR_DUPLICATE_MIN_TOKENS = 20   # fingerprints of very short texts are too unstable
+
+def simhash(text, shingle_size=3):
+    """64-bit SimHash fingerprint of word shingles, or None for short text"""
+    tokens = tokenize(text)
+    if len(tokens) < NEAR_DUPLICATE_MIN_TOKENS:
+        return None
+    
+    weights = [0] * SIMHASH_BITS
+    for i in range(len(tokens) - shingle_size + 1):
+        shingle = ' '.join(tokens[i:i + shingle_size]).encode('utf-8')
+        h = int.from_bytes(hashlib.blake2b(shingle, digest_size=8).digest(), 'big')
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += 1 if h >> bit & 1 else -1
+    
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+class NearDuplicateIndex:
+    """LSH index over SimHash fingerprints of previously generated material"""
+
+    def __init__(self):
+        self.buckets = defaultdict(set)  # (kind, band, band value) -> entry ids
+        self.entries = {}                # entry id -> entry
+        self.lock = threading.RLock()    # shared by every user's requests
+
+    def _bands(self, fingerprint):
+        width = SIMHASH_BITS // SIMHASH_BANDS
+        mask = (1 << width) - 1
+        return [(band, fingerprint >> (band * width) & mask) for band in range(SIMHASH_BANDS)]
+
+    def add(self, kind, entry_id, fingerprint, user_id, topic, result):
+        with self.lock:
+            self.entries[entry_id] = {
+                'id': entry_id,
+                'kind': kind,
+                'fingerprint': fingerprint,
+                'user_id': user_id,
+                'topic': (topic or '').lower(),
+                'result': result
+            }
+            for band, value in self._bands(fingerprint):
+                self.buckets[(kind, band, value)].add(entry_id)
+
+    def remove(self, entry_id, user_id):
+        with self.lock:
+            entry = self.entries.get(entry_id)
+            if not entry or entry['user_id'] != user_id:
+                return
+            del self.entries[entry_id]
+            for band, value in self._bands(entry['fingerprint']):
+                bucket = self.buckets.get((entry['kind'], band, value))
+                if bucket is not None:
+                    bucket.discard(entry_id)
+                    if not bucket:
+                        del self.buckets[(entry['kind'], band, value)]
+
+    def find(self, kind, fingerprint, user_id, topic, accept=None):
+        """Closest prior entry for the same user or topic, or None"""
+        with self.lock:
+            candidates = set()
+            for band, value in self._bands(fingerprint):
+                candidates |= self.buckets.get((kind, band, value), set())
+            
+            topic = (topic or '').lower()
+            best, best_distance = None, NEAR_DUPLICATE_MAX_DISTANCE + 1
+            for entry_id in candidates:
+                entry = self.entries[entry_id]
+                if entry['user_id'] != user_id and entry['topic'] != topic:
+                    continue
+                if accept and not accept(entry):
+                    continue
+                distance = bin(entry['fingerprint'] ^ fingerprint).count('1')
+                # Prefer the user's own material on ties
+                if distance < best_distance or (distance == best_distance and entry['user_id'] == user_id):
+                    best, best_distance = entry, distance
+            return best
+
+near_duplicates = NearDuplicateIndex()
+
+# ==================== QUESTION POOLS ====================
+# Every parsed AI question is kept per user and source text, so a second exam
+# on the same material samples the pool and only asks the LLM for the shortfall
+QUESTION_POOL_MAX = 50
+QUESTION_POOL_PROMPT_AVOID = 20  # pooled questions listed in the prompt as "already asked"
+
+question_pools = defaultdict(dict)  # user_id -> content hash -> {'questions': [...], 'keys': set()}
+
+def content_hash(text):
+    return hashlib.sha256(' '.join(text.split()).encode('utf-8')).hexdigest()
+
+def question_key(text):
+    """Normalized question text used to spot the same question worded trivially differently"""
+    return ' '.join(tokenize(text))
+
+def pooled_questions(user_id, digest):
+    with state_store.user_lock(user_id):
+        pool = question_pools.get(user_id, {}).get(digest)
+        return list(pool['questions']) if pool else []
+
+def sample_questions(pool, num_questions):
+    picked = [q.to_json() for q in random.sample(pool, min(num_questions, len(pool)))]
+    for i, q in enumerate(picked):
+        q['question_number'] = i + 1
+    return picked
+
+# ==================== SPACED REPETITION ====================
+SM2_INITIAL_EASE = 2.5
+SM2_MIN_EASE = 1.3
+RELEARN_DELAY_SECONDS = 10 * 60
+DAY_SECONDS = 24 * 60 * 60
+REVIEW_GRADES = {'again': 1, 'hard': 3, 'good': 4, 'easy': 5}
+
+class FlashcardScheduler:
+    """SM-2 review state for one user's flashcards with a min-heap due queue"""
+
+    def __init__(self):
+        self.states = {}  # card_id -> review state (holds the card itself)
+        self.queue = []   # (due, card_id); entries whose due no longer matches are stale
+
+    def add(self, cards, now=None):
+        now = now or time.time()
+        for card in cards:
+            self.states[card.id] = {
+                'card': card,
+                'ease': SM2_INITIAL_EASE,
+                'interval': 0,      # days
+                'repetitions': 0,
+                'due': now,
+                'last_reviewed': None
+            }
+            heapq.heappush(self.queue, (now, card.id))
+
+    def remove(self, card_id):
+        # The heap entry goes stale and is dropped when it reaches the top
+        return self.states.pop(card_id, None) is not None
+
+    def _is_current(self, entry):
+        state = self.states.get(entry[1])
+        return state is not None and state['due'] == entry[0]
+
+    def due(self, limit, now=None):
+        """Up to limit cards due by now, most overdue first"""
+        now = now or time.time()
+        found = []
+        while self.queue and len(found) < limit:
+            entry = self.queue[0]
+            if not self._is_current(entry):
+                heapq.heappop(self.queue)
+                continue
+            if entry[0] > now:
+                break
+            found.append(heapq.heappop(self.queue))
+        
+        for entry in found:
+            heapq.heappush(self.queue, entry)
+        return [self.states[card_id] for _, card_id in found]
+
+    def next_due(self):
+        while self.queue and not self._is_current(self.queue[0]):
+            heapq.heappop(self.queue)
+        return self.queue[0][0] if self.queue else None
+
+    def review(self, card_id, quality, now=None):
+        """Apply an SM-2 update for a 0-5 quality grade"""
+        now = now or time.time()
+        state = self.states[card_id]
+        
+        if quality < 3:
+            state['repetitions'] = 0
+            state['interval'] = 0
+            state['due'] = now + RELEARN_DELAY_SECONDS
+        else:
+            state['repetitions'] += 1
+            if state['repetitions'] == 1:
+                state['interval'] = 1
+            elif state['repetitions'] == 2:
+                state['interval'] = 6
+            else:
+                state['interval'] = round(state['interval'] * state['ease'])
+            state['due'] = now + state['interval'] * DAY_SECONDS
+        
+        state['ease'] = max(SM2_MIN_EASE, state['ease'] + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+        state['last_reviewed'] = now
+        heapq.heappush(self.queue, (state['due'], card_id))
+        return state
+
+flashcard_schedulers = defaultdict(FlashcardScheduler)
+
+def review_state_json(state):
+    """Card plus its review state, as returned by the flashcard review API"""
+    return dict(
+        state['card'].to_json(),
+        ease=round(state['ease'], 2),
+        interval_days=state['interval'],
+        repetitions=state['repetitions'],
+        due_at=datetime.fromtimestamp(state['due']).isoformat(),
+        last_reviewed=datetime.fromtimestamp(state['last_reviewed']).isoformat() if state['last_reviewed'] else None
+    )
+
+# ==================== EXAM ANALYTICS ====================
+class RunningStats:
+    """Incremental mean/variance of exam percentages plus answer streaks"""
+
+    def __init__(self):
+        self.exams = 0
+        self.mean = 0.0
+        self.m2 = 0.0            # Welford sum of squared deviations
+        self.answered = 0
+        self.correct = 0
+        self.current_streak = 0
+        self.best_streak = 0
+
+    def add(self, percentage, outcomes):
+        self.exams += 1
+        delta = percentage - self.mean
+        self.mean += delta / self.exams
+        self.m2 += delta * (percentage - self.mean)
+        
+        for correct in outcomes:
+            self.answered += 1
+            if correct:
+                self.correct += 1
+                self.current_streak += 1
+                self.best_streak = max(self.best_streak, self.current_streak)
+            else:
+                self.current_streak = 0
+
+    def to_json(self):
+        return {
+            'exams': self.exams,
+            'mean_percentage': round(self.mean, 2),
+            'variance': round(self.m2 / self.exams, 2) if self.exams else 0.0,
+            'questions_answered': self.answered,
+            'questions_correct': self.correct,
+            'accuracy': round(self.correct / self.answered * 100, 2) if self.answered else 0.0,
+            'current_streak': self.current_streak,
+            'best_streak': self.best_streak
+        }
+
+def new_user_analytics():
+    return {
+        'overall': RunningStats(),
+        'topics': defaultdict(RunningStats),
+        'difficulty': defaultdict(RunningStats)
+    }
+
+exam_analytics = defaultdict(new_user_analytics)
+
+def grade_answers(questions, answers):
+    """Check submitted answers against the stored correct answers in one pass"""
+    results = []
+    for i, q in enumerate(questions):
+        question_id = unpack_id(getattr(q, 'id', None))
+        correct_answer = getattr(q, 'correct_answer', 'A')
+        if isinstance(answers, dict):
+            selected = answers.get(question_id, answers.get(str(i)))
+        else:
+            selected = answers[i] if i < len(answers) else None
+        selected = str(selected).strip()[:1].upper() if selected else None
+        correct = selected is not None and selected == correct_answer
+        
+        results.append({
+            'question_id': question_id,
+            'selected': selected,
+            'correct_answer': correct_answer,
+            'correct': correct,
+            'points_awarded': getattr(q, 'points', 10) if correct else 0,
+            'difficulty': getattr(q, 'difficulty', 'Medium')
+        })
+    return results
+
+def record_exam_analytics(user_id, topic, results):
+    """Fold one graded submission into the user's running aggregates"""
+    analytics = exam_analytics[user_id]
+    outcomes = [r['correct'] for r in results]
+    percentage = sum(outcomes) / len(outcomes) * 100 if outcomes else 0.0
+    
+    analytics['overall'].add(percentage, outcomes)
+    analytics['topics'][topic].add(percentage, outcomes)
+    
+    by_difficulty = defaultdict(list)
+    for r in results:
+        by_difficulty[r['difficulty']].append(r['correct'])
+    for difficulty, group in by_difficulty.items():
+        analytics['difficulty'][difficulty].add(sum(group) / len(group) * 100, group)
+
+# ==================== COHORT ANALYTICS ====================
+COHORT_HISTOGRAM_BINS = 10
+COHORT_TOP_N = 50
+COHORT_MIN_ATTEMPTS = 3  # questions answered fewer times are not ranked
+# Usernames allowed to read cohort analytics: the snapshot quotes question text
+# generated from other students' private notes
+COHORT_INSTRUCTORS = {
+    name.strip() for name in os.environ.get("COHORT_INSTRUCTORS", "").split(",") if name.strip()
+}
+
+def grow_array(array, length):
+    """Zero-pad a rollup array along its first axis to length"""
+    if len(array) >= length:
+        return array
+    grown = np.zeros((length,) + array.shape[1:], array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+class AnswerStore:
+    """Columnar store of graded answers across all users with vectorized rollups"""
+
+    COLUMNS = {
+        'user': np.int32,
+        'question': np.int32,
+        'topic': np.int32,
+        'correct': np.bool_,
+        'timestamp': np.int64
+    }
+
+    def __init__(self, capacity=1024):
+        self.size = 0
+        self.columns = {name: np.zeros(capacity, dtype) for name, dtype in self.COLUMNS.items()}
+        
+        # Interned keys: column value -> code, plus labels for the snapshot
+        self.user_codes = {}
+        self.topic_codes = {}
+        self.topics = []
+        self.question_codes = {}
+        self.questions = []      # code -> (question_id, question text, topic code)
+        self.pending_scores = []  # (topic code, percentage) not yet rolled up
+        
+        # Rollups covering rows [0, rolled_up)
+        self.rolled_up = 0
+        self.attempts = np.zeros(0, np.int64)
+        self.correct_counts = np.zeros(0, np.int64)
+        self.score_histograms = np.zeros((0, COHORT_HISTOGRAM_BINS), np.int64)
+        self.snapshot = None
+        self.lock = threading.RLock()  # shared by every user's requests
+
+    def _reserve(self, n):
+        capacity = len(self.columns['user'])
+        if self.size + n <= capacity:
+            return
+        while capacity < self.size + n:
+            capacity *= 2
+        for name, column in self.columns.items():
+            self.columns[name] = grow_array(column, capacity)
+
+    def _topic_code(self, topic):
+        code = self.topic_codes.get(topic)
+        if code is None:
+            code = self.topic_codes[topic] = len(self.topics)
+            self.topics.append(topic)
+        return code
+
+    def _question_code(self, question, topic_code):
+        text = getattr(question, 'question', '')
+        question_id = unpack_id(getattr(question, 'id', None)) or text
+        code = self.question_codes.get(question_id)
+        if code is None:
+            code = self.question_codes[question_id] = len(self.questions)
+            self.questions.append((question_id, text[:200], topic_code))
+        return code
+
+    def append(self, user_id, topic, questions, results, timestamp=None):
+        """Add the rows of one graded submission"""
+        with self.lock:
+            self._append(user_id, topic, questions, results, timestamp)
+
+    def _append(self, user_id, topic, questions, results, timestamp):
+        n = len(results)
+        if not n:
+            return
+        self._reserve(n)
+        
+        start, end = self.size, self.size + n
+        topic_code = self._topic_code(topic)
+        user_code = self.user_codes.setdefault(user_id, len(self.user_codes))
+        correct = np.fromiter((r['correct'] for r in results), np.bool_, n)
+        
+        self.columns['user'][start:end] = user_code
+        self.columns['topic'][start:end] = topic_code
+        self.columns['question'][start:end] = [self._question_code(q, topic_code) for q in questions[:n]]
+        self.columns['correct'][start:end] = correct
+        self.columns['timestamp'][start:end] = int(timestamp or time.time())
+        
+        self.pending_scores.append((topic_code, correct.mean() * 100))
+        self.size = end
+
+    def refresh(self):
+        """Fold rows added since the last refresh into the rollups"""
+        with self.lock:
+            return self._refresh()
+
+    def _refresh(self):
+        if self.snapshot is not None and self.rolled_up == self.size:
+            return self.snapshot
+        
+        start, end = self.rolled_up, self.size
+        n_questions = len(self.questions)
+        question = self.columns['question'][start:end]
+        correct = self.columns['correct'][start:end]
+        
+        self.attempts = grow_array(self.attempts, n_questions)
+        self.attempts += np.bincount(question, minlength=n_questions)
+        self.correct_counts = grow_array(self.correct_counts, n_questions)
+        self.correct_counts += np.bincount(question, weights=correct, minlength=n_questions).astype(np.int64)
+        
+        self.score_histograms = grow_array(self.score_histograms, len(self.topics))
+        if self.pending_scores:
+            topic_codes, scores = np.array(self.pending_scores).T
+            bins = np.minimum(scores // (100 / COHORT_HISTOGRAM_BINS), COHORT_HISTOGRAM_BINS - 1)
+            np.add.at(self.score_histograms, (topic_codes.astype(np.intp), bins.astype(np.intp)), 1)
+            self.pending_scores = []
+        
+        self.rolled_up = end
+        self.snapshot = self._build_snapshot()
+        return self.snapshot
+
+    def _question_json(self, code, **extra):
+        question_id, text, topic_code = self.questions[code]
+        return dict(
+            question_id=question_id,
+            question=text,
+            topic=self.topics[topic_code],
+            attempts=int(self.attempts[code]),
+            **extra
+        )
+
+    def _build_snapshot(self):
+        attempts, correct = self.attempts, self.correct_counts
+        percent_correct = np.divide(
+            correct * 100.0, attempts,
+            out=np.zeros(len(attempts)), where=attempts > 0
+        )
+        
+        ranked = np.flatnonzero(attempts >= COHORT_MIN_ATTEMPTS)
+        hardest = ranked[np.argsort(percent_correct[ranked], kind='stable')[:COHORT_TOP_N]]
+        
+        misses = attempts - correct
+        top = min(COHORT_TOP_N, len(misses))
+        most_missed = np.argpartition(-misses, top - 1)[:top] if top else misses[:0]
+        most_missed = most_missed[np.argsort(-misses[most_missed], kind='stable')]
+        most_missed = most_missed[misses[most_missed] > 0]
+        
+        edges = np.linspace(0, 100, COHORT_HISTOGRAM_BINS + 1).astype(int).tolist()
+        total_answers = int(attempts.sum())
+        
+        return {
+            'generated_at': datetime.now().isoformat(),
+            'total_answers': total_answers,
+            'total_users': len(self.user_codes),
+            'total_questions': len(self.questions),
+            'overall_accuracy': round(float(correct.sum()) / total_answers * 100, 2) if total_answers else 0.0,
+            'question_difficulty': [
+                self._question_json(code, percent_correct=round(float(percent_correct[code]), 2))
+                for code in hardest
+            ],
+            'most_missed': [
+                self._question_json(code, misses=int(misses[code]))
+                for code in most_missed
+            ],
+            'score_histograms': {
+                topic: {'bins': edges, 'counts': self.score_histograms[code].tolist()}
+                for code, topic in enumerate(self.topics)
+            }
+        }
+
+cohort_answers = AnswerStore()
+
+# ==================== STATE STORE ====================
+# Every change to user state is an event applied by its EVENT_HANDLERS entry;
+# the dicts and indexes above are the read model. The store makes each change
+# atomic with its validation, and the sqlite backend shares the event log
+# between worker processes.
+STATE_BACKEND = os.environ.get("STATE_BACKEND", "memory")  # or sqlite:///path/to/state.db
+
+EVENT_HANDLERS = {}
+
+def event_handler(op):
+    def register(handler):
+        EVENT_HANDLERS[op] = handler
+        return handler
+    return register
+
+@event_handler('user_created')
+def apply_user_created(event):
+    user = event['user']
+    users_db[event['username']] = user
+    study_materials_db.setdefault(user['id'], [])
+    flashcards_db.setdefault(user['id'], {})
+    exams_db.setdefault(user['id'], [])
+
+@event_handler('material_added')
+def apply_material_added(event):
+    user_id, material = event['user_id'], Material.from_json(event['material'])
+    study_materials_db.setdefault(user_id, []).append(material)
+    index_summary(user_id, material)
+
+@event_handler('flashcards_added')
+def apply_flashcards_added(event):
+    user_id, flashcards = event['user_id'], [Flashcard.from_json(card) for card in event['flashcards']]
+    if not flashcards:
+        return
+    # Events logged before decks existed become a deck named after their first card
+    first = event['flashcards'][0]
+    deck = Deck.from_json(event.get('deck') or {
+        'id': first['id'], 'category': first.get('category'), 'created_at': first.get('created_at'), 'source': 'text'
+    })
+    deck.cards = tuple(flashcards)
+    flashcards_db.setdefault(user_id, {})[deck.id] = deck
+    index_flashcards(user_id, deck)
+    flashcard_schedulers[user_id].add(flashcards, now=event['timestamp'])
+
+@event_handler('flashcard_reviewed')
+def apply_flashcard_reviewed(event):
+    scheduler = flashcard_schedulers[event['user_id']]
+    card_id = pack_id(event['card_id'])
+    if card_id in scheduler.states:
+        scheduler.review(card_id, event['quality'], now=event['timestamp'])
+
+@event_handler('exam_created')
+def apply_exam_created(event):
+    # The active exam and its exams_db record share one list of question records
+    questions = [Question.from_json(q) for q in event['exam']['questions']]
+    user_id, exam = event['user_id'], dict(event['exam'], questions=questions)
+    active_exams[exam['exam_id']] = exam
+    exams_db.setdefault(user_id, []).append(dict(event['record'], questions=questions))
+    index_exam_questions(user_id, exam['exam_id'], exam['type'], exam['questions'])
+
+@event_handler('exam_result_saved')
+def apply_exam_result_saved(event):
+    exams_db.setdefault(event['user_id'], []).append(event['result'])
+
+@event_handler('exam_graded')
+def apply_exam_graded(event):
+    user_id, exam = event['user_id'], active_exams[event['exam_id']]
+    result = dict(event['result'], questions=exam['questions'])
+    exam['score'] = result['score']
+    exam['status'] = 'completed'
+    
+    record_exam_analytics(user_id, exam['type'], result['results'])
+    cohort_answers.append(user_id, exam['type'], exam['questions'], result['results'], event['timestamp'])
+    exams_db.setdefault(user_id, []).append(result)
+
+@event_handler('near_duplicate_added')
+def apply_near_duplicate_added(event):
+    if event.get('replaces'):
+        near_duplicates.remove(event['replaces'], event['user_id'])
+    near_duplicates.add(
+        event['kind'], event['entry_id'], event['fingerprint'],
+        event['user_id'], event['topic'], event['result']
+    )
+
+@event_handler('questions_pooled')
+def apply_questions_pooled(event):
+    pool = question_pools[event['user_id']].setdefault(event['digest'], {'questions': [], 'keys': set()})
+    for q in event['questions']:
+        key = question_key(q['question'])
+        if key and key not in pool['keys'] and len(pool['questions']) < QUESTION_POOL_MAX:
+            pool['keys'].add(key)
+            pool['questions'].append(Question.from_json(q))
+
+@event_handler('material_deleted')
+def apply_material_deleted(event):
+    user_id, material_id = event['user_id'], event['material_id']
+    packed_id = pack_id(material_id)
+    
+    # Delete from study materials
+    if user_id in study_materials_db:
+        study_materials_db[user_id] = [
+            m for m in study_materials_db[user_id] 
+            if m.id != packed_id
+        ]
+    
+    # Delete a whole deck, or a single card from its deck
+    decks = flashcards_db.get(user_id, {})
+    deck = decks.pop(packed_id, None)
+    for card in deck.cards if deck else ():
+        flashcard_schedulers[user_id].remove(card.id)
+    for deck_id, other in list(decks.items()):
+        if any(card.id == packed_id for card in other.cards):
+            other.cards = tuple(card for card in other.cards if card.id != packed_id)
+            if user_id in search_indexes:
+                search_indexes[user_id].discard('flashcard', material_id)
+            if not other.cards:
+                del decks[deck_id]
+    
+    # Delete from exams
+    if user_id in exams_db:
+        exams_db[user_id] = [
+            e for e in exams_db[user_id]
+            if e.get('exam_id') != material_id and e.get('id') != material_id
+        ]
+    
+    # A deleted exam can no longer be graded back into exams_db
+    exam = active_exams.get(material_id)
+    if exam is not None and exam.get('user_id') == user_id:
+        del active_exams[material_id]
+    
+    # Delete from search index
+    if user_id in search_indexes:
+        search_indexes[user_id].remove(material_id)
+    
+    # Delete from review schedule
+    if user_id in flashcard_schedulers:
+        flashcard_schedulers[user_id].remove(packed_id)
+    
+    # Stop reusing a deleted summary for near-duplicate requests
+    near_duplicates.remove(material_id, user_id)
+
+@event_handler('lecture_started')
+def apply_lecture_started(event):
+    lecture_sessions[event['lecture']['id']] = dict(
+        event['lecture'],
+        user_id=event['user_id'],
+        chunks=[],
+        summarized_through=0,  # chunks already folded into segments
+        segments=[],           # running notes, one entry per summarized delta
+        status='active'
+    )
+
+@event_handler('lecture_chunk_appended')
+def apply_lecture_chunk_appended(event):
+    lecture_sessions[event['lecture_id']]['chunks'].append(event['text'])
+
+@event_handler('lecture_summary_updated')
+def apply_lecture_summary_updated(event):
+    lecture = lecture_sessions[event['lecture_id']]
+    lecture['summarized_through'] = event['through']
+    lecture['segments'] = event['segments']
+
+@event_handler('lecture_finished')
+def apply_lecture_finished(event):
+    lecture = lecture_sessions[event['lecture_id']]
+    lecture['status'] = 'finished'
+    lecture['material_id'] = event['material_id']
+
+class MemoryStateStore:
+    """Single-process store: per-user locks around the in-memory state"""
+
+    def __init__(self):
+        self.users_lock = threading.RLock()  # guards users_db (signup)
+        self.user_locks = {}
+        self.guard = threading.Lock()
+
+    def user_lock(self, user_id):
+        with self.guard:
+            lock = self.user_locks.get(user_id)
+            if lock is None:
+                lock = self.user_locks[user_id] = threading.RLock()
+            return lock
+
+    def lock_for(self, event):
+        user_id = event.get('user_id')
+        return self.user_lock(user_id) if user_id else self.users_lock
+
+    def apply(self, event):
+        with self.lock_for(event):
+            EVENT_HANDLERS[event['op']](event)
+
+    def sync(self):
+        pass
+
+    def commit(self, event, check=None):
+        """Apply event atomically with check; returns check's (error, status) or None"""
+        event.setdefault('timestamp', time.time())
+        with self.lock_for(event):
+            error = check() if check else None
+            if error:
+                return error
+            self.apply(event)
+        return None
+    
+    def claim_request(self, entry_key, fingerprint, created):
+        """Another worker's hold on an idempotency key (see IDEMPOTENCY); never one in a single process"""
+        return None
+    
+    def finish_request(self, entry_key, created, response=None):
+        pass
+
+class SqliteStateStore(MemoryStateStore):
+    """Event log in SQLite shared by worker processes, replayed into each one's memory"""
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.seq = 0                     # last event applied in this process
+        self.log_lock = threading.RLock()
+        self.local = threading.local()   # sqlite connections are per thread
+        conn = self._connect()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS events (seq INTEGER PRIMARY KEY AUTOINCREMENT, body TEXT NOT NULL)')
+        # Idempotency keys are shared too, so a retry landing on another worker replays
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS idempotency_keys (user_id TEXT, endpoint TEXT, key TEXT, '
+            'created REAL NOT NULL, fingerprint TEXT NOT NULL, status INTEGER, content_type TEXT, body BLOB, '
+            'PRIMARY KEY (user_id, endpoint, key))'
+        )
+        self.sync()
+
+    def _connect(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        return conn
+
+    def sync(self):
+        """Replay events written by any worker since the last sync"""
+        with self.log_lock:
+            rows = self._connect().execute(
+                'SELECT seq, body FROM events WHERE seq > ? ORDER BY seq', (self.seq,)
+            ).fetchall()
+            for seq, body in rows:
+                self.apply(json.loads(body))
+                self.seq = seq
+
+    def commit(self, event, check=None):
+        event.setdefault('timestamp', time.time())
+        conn = self._connect()
+        with self.log_lock:
+            # The write lock makes check see every other worker's committed events
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                self.sync()
+                with self.lock_for(event):
+                    error = check() if check else None
+                if not error:
+                    conn.execute('INSERT INTO events (body) VALUES (?)', (json.dumps(event),))
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('ROLLBACK' if error else 'COMMIT')
+            if error:
+                return error
+            self.sync()
+        return None
+    
+    def claim_request(self, entry_key, fingerprint, created):
+        """Claim an idempotency key for this worker, or return its holder's fingerprint and response"""
+        conn = self._connect()
+        now = time.time()
+        with self.log_lock:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute('DELETE FROM idempotency_keys WHERE created < ?', (now - IDEMPOTENCY_TTL_SECONDS,))
+                row = conn.execute(
+                    'SELECT created, fingerprint, status, content_type, body FROM idempotency_keys '
+                    'WHERE user_id = ? AND endpoint = ? AND key = ?', entry_key
+                ).fetchone()
+                # A claim still running this long is taken over (its worker probably died)
+                if row is None or row[2] is None and now - row[0] > IDEMPOTENCY_PENDING_SECONDS:
+                    conn.execute(
+                        'INSERT OR REPLACE INTO idempotency_keys (user_id, endpoint, key, created, fingerprint) '
+                        'VALUES (?, ?, ?, ?, ?)', (*entry_key, created, fingerprint)
+                    )
+                    row = None
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+        if row is None:
+            return None
+        created, fingerprint, status, content_type, body = row
+        return {'fingerprint': fingerprint, 'response': None if status is None else (body, status, content_type)}
+    
+    def finish_request(self, entry_key, created, response=None):
+        """Record the (data, status, content_type) of a claimed key, or release it when None"""
+        conn = self._connect()
+        with self.log_lock:
+            if response is None:
+                conn.execute(
+                    'DELETE FROM idempotency_keys WHERE user_id = ? AND endpoint = ? AND key = ? '
+                    'AND created = ? AND status IS NULL', (*entry_key, created)
+                )
+            else:
+                data, status, content_type = response
+                conn.execute(
+                    'UPDATE idempotency_keys SET status = ?, content_type = ?, body = ? '
+                    'WHERE user_id = ? AND endpoint = ? AND key = ? AND created = ?',
+                    (status, content_type, data, *entry_key, created)
+                )
+
+if STATE_BACKEND.startswith('sqlite:///'):
+    state_store = SqliteStateStore(STATE_BACKEND[len('sqlite:///'):])
+else:
+    state_store = MemoryStateStore()
+
+# ==================== PROMPT BUDGETING ====================
+MODEL_CONTEXT_TOKENS = 131072  # llama-3.3-70b-versatile context window
+PROMPT_INPUT_TOKENS = int(os.environ.get("PROMPT_INPUT_TOKENS", 6000))  # cap on study material per prompt
+PROMPT_SAFETY_TOKENS = 64
+PROMPT_CHUNK_TOKENS = 200
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text):
+    """Rough local token count (about 4 characters or 3/4 of a word per token)"""
+    if not text:
+        return 0
+    return max(len(text) // CHARS_PER_TOKEN, len(text.split()) * 4 // 3) + 1
+
+def chunk_text(text, max_tokens=PROMPT_CHUNK_TOKENS):
+    """Split text into paragraph/sentence chunks of roughly max_tokens each"""
+    chunks, current, current_tokens = [], [], 0
+    for paragraph in re.split(r'\n\s*\n', text):
+        for sentence in re.split(r'(?<=[.!?])\s+', paragraph.strip()):
+            if not sentence:
+                continue
+            tokens = estimate_tokens(sentence)
+            if current and current_tokens + tokens > max_tokens:
+                chunks.append(' '.join(current))
+                current, current_tokens = [], 0
+            current.append(sentence)
+            current_tokens += tokens
+        if current:
+            chunks.append(' '.join(current))
+            current, current_tokens = [], 0
+    return chunks
+
+def chunk_terms(chunk):
+    return set(t for t in tokenize(chunk) if len(t) > 3)
+
+def select_relevant_chunks(text, budget_tokens, focus=None):
+    """Keep the most central chunks of text that fit in budget_tokens, in original order"""
+    if isinstance(text, MappedDocument) and len(text) <= budget_tokens * CHARS_PER_TOKEN:
+        text = text.read()
+    if isinstance(text, str):
+        if estimate_tokens(text) <= budget_tokens:
+            return text
+        chunks = chunk_text(text)
+    else:
+        chunks = text  # re-read from the mapped file on every pass
+    
+    # A chunk is central when it shares many terms with the rest of the material
+    doc_freq = defaultdict(int)
+    for chunk in chunks:
+        for term in chunk_terms(chunk):
+            doc_freq[term] += 1
+    focus_terms = set(tokenize(focus))
+    
+    def score(i, terms):
+        if not terms:
+            return 0.0
+        centrality = sum(doc_freq[t] - 1 for t in terms) / len(terms)
+        return centrality + 2 * len(terms & focus_terms) + (1 if i == 0 else 0)
+    
+    scored = [(score(i, chunk_terms(chunk)), i, estimate_tokens(chunk)) for i, chunk in enumerate(chunks)]
+    chosen, used = set(), 0
+    for _, i, tokens in sorted(scored, key=lambda entry: entry[0], reverse=True):
+        if used + tokens > budget_tokens:
+            continue
+        chosen.add(i)
+        used += tokens
+    
+    if not chosen:
+        return text[:budget_tokens * CHARS_PER_TOKEN] if isinstance(text, str) else text.read(budget_tokens * CHARS_PER_TOKEN)
+    return '\n...\n'.join(chunk for i, chunk in enumerate(chunks) if i in chosen)
+
+def build_prompt(template, text, max_tokens, focus=None, system_message=None):
+    """Fill the {content} slot of template with as much relevant text as the context allows"""
+    overhead = estimate_tokens(template) + estimate_tokens(system_message) + PROMPT_SAFETY_TOKENS
+    budget = min(PROMPT_INPUT_TOKENS, MODEL_CONTEXT_TOKENS - max_tokens - overhead)
+    return template.replace('{content}', select_relevant_chunks(text, budget, focus))
+
+def summary_output_tokens(text):
+    """Shorter material needs a shorter summary"""
+    return max(400, min(1000, 300 + estimate_tokens(text) // 3))
+
+def exam_output_tokens(num_questions):
+    # Each formatted question with options and explanation is ~130 tokens
+    return min(150 + 130 * num_questions, 4000)
+
+SUGGESTION_OUTPUT_TOKENS = 500
+
+# ==================== DOCUMENT UPLOADS ====================
+# Werkzeug spools each uploaded file straight to a temporary file on disk,
+# which is then memory-mapped, so a whole textbook is only ever held in
+# memory one block at a time while it is chunked; the prompt pipelines then
+# get a budget-sized excerpt. MAX_CONTENT_LENGTH rejects oversized bodies
+# before any of them is written to disk.
+UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", 64 * 1024 * 1024))
+UPLOAD_FORM_OVERHEAD = 64 * 1024  # multipart boundaries and the topic/action fields
+UPLOAD_BLOCK_BYTES = 1024 * 1024
+UPLOAD_TEXT_EXTENSIONS = ('.txt', '.md', '.markdown')
+
+app.config['MAX_CONTENT_LENGTH'] = UPLOAD_MAX_BYTES + UPLOAD_FORM_OVERHEAD
+
+class UploadRequest(Request):
+    """Request whose file uploads always go to a real temporary file, never memory"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.TemporaryFile('w+b')
+
+app.request_class = UploadRequest
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    return jsonify({'error': f'Documents are limited to {UPLOAD_MAX_BYTES // (1024 * 1024)}MB'}), 413
+
+class MappedDocument:
+    """Read-only memory-mapped UTF-8 text that iterates as prompt-sized chunks"""
+
+    def __init__(self, fileobj):
+        self.map = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.map)
+
+    def close(self):
+        self.map.close()
+
+    def read(self, limit=None):
+        return self.map[:limit].decode('utf-8', errors='replace')
+
+    def blocks(self):
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        for start in range(0, len(self.map), UPLOAD_BLOCK_BYTES):
+            yield decoder.decode(self.map[start:start + UPLOAD_BLOCK_BYTES])
+        yield decoder.decode(b'', final=True)
+
+    def __iter__(self):
+        pending = ''
+        for block in self.blocks():
+            pending += block
+            # Chunk up to the last paragraph break; the rest may continue in the next block
+            cut = pending.rfind('\n\n')
+            if cut < 0 and len(pending) > UPLOAD_BLOCK_BYTES:
+                cut = max(pending.rfind('\n'), pending.rfind(' '))
+                if cut <= 0:
+                    cut = len(pending)
+            if cut < 0:
+                continue
+            yield from chunk_text(pending[:cut])
+            pending = pending[cut:]
+        if pending.strip():
+            yield from chunk_text(pending)
+
+def extract_pdf_text(source, spool):
+    """Write the text of each PDF page to spool as its own paragraph"""
+    for page in PdfReader(source).pages:
+        spool.write((page.extract_text() or '').encode('utf-8') + b'\n\n')
+
+# ==================== LIVE LECTURES ====================
+LECTURE_DELTA_TOKENS = 800    # summarize once this much new transcript has arrived
+LECTURE_CONTEXT_TOKENS = 300  # tail of the summarized transcript kept as context
+LECTURE_NOTES_TOKENS = 1500   # running notes are compacted beyond this
+LECTURE_SEGMENT_OUTPUT_TOKENS = 400
+
+def extractive_notes(text, max_points=3):
+    """Fallback notes: the first few substantial sentences as bullets"""
+    sentences = [s.strip() for s in re.split(r'[.!?]+', text) if len(s.strip()) > 20]
+    return '\n'.join(f"• {s}" for s in sentences[:max_points]) or f"• {text[:200]}"
+
+def lecture_context(chunks):
+    """Tail of the already-summarized transcript, about LECTURE_CONTEXT_TOKENS long"""
+    tail, tokens = [], 0
+    for chunk in reversed(chunks):
+        tail.append(chunk)
+        tokens += estimate_tokens(chunk)
+        if tokens >= LECTURE_CONTEXT_TOKENS:
+            break
+    return ' '.join(reversed(tail))[-LECTURE_CONTEXT_TOKENS * CHARS_PER_TOKEN:]
+
+def summarize_lecture_delta(subject, chunks, summarized_through, segments):
+    """Summarize only the transcript since the last update and merge it into the running notes"""
+    through = len(chunks)
+    delta = ' '.join(chunks[summarized_through:through])
+    context = lecture_context(chunks[:summarized_through])
+    
+    prompt = f"""You are taking running notes during a live lecture on {subject}.
+
+PREVIOUS NOTES (already written, do not repeat):
+{segments[-1] if segments else '(none yet)'}
+
+END OF THE PREVIOUS TRANSCRIPT (context only):
+{context or '(start of lecture)'}
+
+NEW TRANSCRIPT:
+{delta}
+
+Write concise bullet-point notes covering ONLY the new transcript: key concepts, definitions and examples."""
+    
+    segment = call_groq(
+        prompt, "You are a precise lecture note-taker.",
+        max_tokens=LECTURE_SEGMENT_OUTPUT_TOKENS, temperature=0.3
+    )
+    segments = segments + [segment or extractive_notes(delta)]
+    
+    # Keep the running notes bounded by condensing everything but the newest segment
+    if len(segments) > 2 and estimate_tokens('\n\n'.join(segments)) > LECTURE_NOTES_TOKENS:
+        earlier = '\n\n'.join(segments[:-1])
+        condensed = call_groq(
+            f"Condense these lecture notes on {subject} into a shorter set of bullet points, keeping every key concept:\n\n{earlier}",
+            "You are a precise lecture note-taker.",
+            max_tokens=LECTURE_NOTES_TOKENS // 2, temperature=0.3
+        )
+        if condensed:
+            segments = [condensed, segments[-1]]
+    
+    return through, segments
+
+lectures_summarizing = set()  # lecture ids with a delta summary in flight in this process
+
+def fold_lecture_delta(user_id, lecture_id, min_tokens, force=False):
+    """Summarize the pending transcript once at least min_tokens have arrived"""
+    with state_store.user_lock(user_id):
+        lecture = lecture_sessions[lecture_id]
+        chunks = list(lecture['chunks'])
+        segments = list(lecture['segments'])
+        summarized_through = lecture['summarized_through']
+        pending = estimate_tokens(' '.join(chunks[summarized_through:]))
+        if not pending or pending < min_tokens:
+            return
+        if lecture_id in lectures_summarizing and not force:
+            return
+        lectures_summarizing.add(lecture_id)
+    
+    try:
+        through, segments = summarize_lecture_delta(lecture['subject'], chunks, summarized_through, segments)
+        # A concurrent update that already covered more of the transcript wins
+        state_store.commit(
+            {'op': 'lecture_summary_updated', 'user_id': user_id, 'lecture_id': lecture_id,
+             'through': through, 'segments': segments},
+            check=lambda: ('Lecture notes already updated', 409)
+            if lecture_sessions[lecture_id]['summarized_through'] >= through else None
+        )
+    finally:
+        with state_store.user_lock(user_id):
+            lectures_summarizing.discard(lecture_id)
+
+def lecture_status_json(lecture):
+    return {
+        'lecture_id': lecture['id'],
+        'subject': lecture['subject'],
+        'status': lecture['status'],
+        'chunks': len(lecture['chunks']),
+        'summarized_chunks': lecture['summarized_through'],
+        'notes': '\n\n'.join(lecture['segments'])
+    }
+
+# ==================== CAPTION FILES ====================
+CAPTION_TIMING_RE = re.compile(
+    r'(?:(\d+):)?(\d{1,2}):(\d{2})[.,](\d{3})\s*-->\s*(?:(\d+):)?(\d{1,2}):(\d{2})[.,](\d{3})'
+)
+CAPTION_TAG_RE = re.compile(r'<[^>]*>')  # <i>, <c.color>, <v Speaker>, <00:00:01.000>
+SENTENCE_SPLIT_RE = re.compile(r'(?<=[.!?])\s+')
+CAPTION_OVERLAP_WORDS = 20
+
+def caption_seconds(hours, minutes, seconds, millis):
+    return int(hours or 0) * 3600 + int(minutes) * 60 + int(seconds) + int(millis) / 1000
+
+def format_timestamp(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes:02d}:{seconds:02d}"
+
+def iter_caption_cues(lines):
+    """Stream (start, end, text) cues from WebVTT or SRT lines"""
+    start = end = None
+    text_lines = []
+    skipping = False  # inside a NOTE/STYLE/REGION block
+    
+    for raw in lines:
+        line = raw.strip().lstrip('\ufeff')
+        if not line:
+            if start is not None and text_lines:
+                yield start, end, ' '.join(text_lines)
+            start = end = None
+            text_lines = []
+            skipping = False
+            continue
+        if skipping:
+            continue
+        
+        timing = CAPTION_TIMING_RE.search(line)
+        if timing:
+            if start is not None and text_lines:
+                yield start, end, ' '.join(text_lines)
+            groups = timing.groups()
+            start, end = caption_seconds(*groups[:4]), caption_seconds(*groups[4:])
+            text_lines = []
+        elif start is None:
+            # WEBVTT header, cue identifiers and SRT sequence numbers
+            if line.startswith(('NOTE', 'STYLE', 'REGION')):
+                skipping = True
+        else:
+            text = html.unescape(CAPTION_TAG_RE.sub('', line)).strip()
+            if text:
+                text_lines.append(text)
+    
+    if start is not None and text_lines:
+        yield start, end, ' '.join(text_lines)
+
+def caption_overlap(previous, words):
+    """Number of leading words repeated from the previous cue (rolling captions)"""
+    for size in range(min(len(previous), len(words)), 0, -1):
+        if previous[-size:] == words[:size]:
+            return size
+    return 0
+
+def iter_caption_chunks(cues, max_tokens=PROMPT_CHUNK_TOKENS):
+    """Merge cue fragments into sentences and group them into time-anchored chunks"""
+    previous = []
+    sentence, sentence_start = '', None
+    chunk, chunk_tokens, chunk_start, chunk_end = [], 0, None, None
+    
+    def sentences_from(text):
+        parts = SENTENCE_SPLIT_RE.split(text)
+        rest = parts.pop()
+        # Captions without punctuation would otherwise never end a sentence
+        if rest.endswith(('.', '!', '?')) or estimate_tokens(rest) > max_tokens:
+            parts.append(rest)
+            rest = ''
+        return parts, rest
+    
+    for start, end, text in cues:
+        words = text.split()
+        new_words = words[caption_overlap(previous, words):]
+        previous = words[-CAPTION_OVERLAP_WORDS:]
+        if not new_words:
+            continue
+        
+        if sentence_start is None:
+            sentence_start = start
+        complete, sentence = sentences_from(f"{sentence} {' '.join(new_words)}".strip())
+        
+        for finished in complete:
+            if chunk_start is None:
+                chunk_start = sentence_start
+            chunk.append(finished)
+            chunk_tokens += estimate_tokens(finished)
+            chunk_end = end
+            if chunk_tokens >= max_tokens:
+                yield {'start': chunk_start, 'end': chunk_end, 'text': ' '.join(chunk)}
+                chunk, chunk_tokens, chunk_start = [], 0, None
+            sentence_start = start
+        if not sentence:
+            sentence_start = None
+    
+    if sentence:
+        chunk.append(sentence)
+        chunk_start = chunk_start if chunk_start is not None else sentence_start
+        chunk_end = end
+    if chunk:
+        yield {'start': chunk_start, 'end': chunk_end, 'text': ' '.join(chunk)}
+
+# ==================== PREFETCH ====================
+# Most users go on to create an exam or flashcards from the text they just
+# summarized, so an opt-in summarize schedules both on a low-priority pool and
+# the follow-up request picks up the finished result.
+PREFETCH_BY_DEFAULT = os.environ.get("PREFETCH_BY_DEFAULT", "false").lower() == "true"
+PREFETCH_TTL_SECONDS = int(os.environ.get("PREFETCH_TTL_SECONDS", 1800))
+PREFETCH_CONCURRENCY = 2
+PREFETCH_MAX_JOBS = 1000
+PREFETCH_EXAM_QUESTIONS = 5
+PREFETCH_FLASHCARDS = 12
+
+# Its own small pool, so prefetch never takes more than PREFETCH_CONCURRENCY threads
+prefetch_pool = concurrent.futures.ThreadPoolExecutor(PREFETCH_CONCURRENCY, thread_name_prefix='prefetch')
+prefetch_jobs = {}  # (user_id, content hash, kind) -> job
+prefetch_lock = threading.Lock()
+
+def prefetch_exam(user_id, text, topic):
+    return create_exam_from_text(
+        text, topic, PREFETCH_EXAM_QUESTIONS, user_id=user_id, fallback=False
+    )
+
+def prefetch_flashcards(user_id, text, topic):
+    flashcards, source = generate_flashcard_deck(text, topic, PREFETCH_FLASHCARDS)
+    # Keep only all-AI decks; a short, topped-up ('mixed') deck is regenerated on request
+    return flashcards if source == 'ai' else None
+
+PREFETCH_KINDS = {'exam': prefetch_exam, 'flashcards': prefetch_flashcards}
+
+def run_prefetch(job, kind, user_id, text, topic):
+    job['state'] = 'running'
+    token = background_job.set(job)
+    try:
+        job['result'] = PREFETCH_KINDS[kind](user_id, text, topic)
+    except Exception as e:
+        print(f"Prefetch {kind} failed: {str(e)}")
+    finally:
+        background_job.reset(token)
+    job['state'] = 'done'
+
+def purge_prefetch_jobs(now):
+    with prefetch_lock:
+        for key in [key for key, job in prefetch_jobs.items() if now - job['created'] > PREFETCH_TTL_SECONDS]:
+            prefetch_jobs.pop(key)['future'].cancel()
+
+def schedule_prefetch(user_id, text, topic):
+    """Queue background exam and flashcard generation for text; returns its prefetch id"""
+    now = time.time()
+    purge_prefetch_jobs(now)
+    digest = content_hash(text)
+    with prefetch_lock:
+        for kind in PREFETCH_KINDS:
+            key = (user_id, digest, kind)
+            if key in prefetch_jobs or len(prefetch_jobs) >= PREFETCH_MAX_JOBS:
+                continue
+            job = {'state': 'queued', 'result': None, 'waiters': 0, 'created': now}
+            job['future'] = prefetch_pool.submit(run_prefetch, job, kind, user_id, text, topic)
+            prefetch_jobs[key] = job
+    return digest
+
+def cancel_prefetch(user_id, digest):
+    """Drop queued or running prefetch work; returns how many jobs were cancelled"""
+    with prefetch_lock:
+        jobs = [prefetch_jobs.pop((user_id, digest, kind), None) for kind in PREFETCH_KINDS]
+    jobs = [job for job in jobs if job is not None]
+    for job in jobs:
+        job['future'].cancel()
+    return len(jobs)
+
+def take_prefetched(user_id, text, kind):
+    """Consume the prefetched result for text, waiting if it is being generated right now"""
+    key = (user_id, content_hash(text), kind)
+    with prefetch_lock:
+        job = prefetch_jobs.pop(key, None)
+    if job is None or time.time() - job['created'] > PREFETCH_TTL_SECONDS:
+        return None
+    
+    if job['state'] == 'queued':
+        # Still waiting for a slot: generating inline is faster than queueing behind other work
+        job['future'].cancel()
+        return None
+    if job['state'] == 'running':
+        job['waiters'] += 1
+        try:
+            job['future'].result()
+        except (concurrent.futures.CancelledError, Exception):
+            return None
+    return job['result']
+
+# ==================== IDEMPOTENCY ====================
+# A retried generating POST that carries the same Idempotency-Key attaches to
+# the first request while it runs and replays its response afterwards, so an
+# impatient double click costs one LLM call and saves one record. Retries in
+# the same process wait on the first request's future; under the sqlite
+# backend the key is also claimed in the shared database, and a retry on
+# another worker polls it for the recorded response.
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", 3600))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+IDEMPOTENCY_PENDING_SECONDS = 600  # a claim running longer than this is abandoned
+IDEMPOTENCY_POLL_SECONDS = 0.25
+
+idempotent_requests = {}        # (user_id, endpoint, key) -> entry
+idempotency_expiry = deque()    # (created, entry key) in creation order
+idempotency_lock = threading.Lock()
+
+def request_fingerprint():
+    """Hash of what the client sent, to reject a key reused for a different request"""
+    digest = hashlib.sha256(request.path.encode('utf-8'))
+    if request.files:
+        # Uploads are identified by their form fields and file names rather than re-read
+        for name, value in sorted(request.form.items(multi=True)):
+            digest.update(f"{name}={value}\n".encode('utf-8'))
+        for name, upload in sorted(request.files.items(multi=True)):
+            digest.update(f"{name}:{upload.filename}\n".encode('utf-8'))
+    else:
+        digest.update(request.get_data())
+    return digest.hexdigest()
+
+def purge_idempotency_keys(now):
+    while idempotency_expiry and now - idempotency_expiry[0][0] > IDEMPOTENCY_TTL_SECONDS:
+        created, key = idempotency_expiry.popleft()
+        entry = idempotent_requests.get(key)
+        if entry and entry['created'] == created:
+            del idempotent_requests[key]
+
+def shared_idempotent_response(entry_key, fingerprint, created):
+    """Another worker's response for the key, waiting while it runs; None once this worker holds the key"""
+    while True:
+        claim = state_store.claim_request(entry_key, fingerprint, created)
+        if claim is None:
+            return None
+        if claim['fingerprint'] != fingerprint:
+            return app.make_response((jsonify({'error': 'Idempotency-Key was already used for a different request'}), 422))
+        if claim['response']:
+            data, status, content_type = claim['response']
+            replay = app.response_class(data, status=status, content_type=content_type)
+            replay.headers['Idempotent-Replayed'] = 'true'
+            return replay
+        time.sleep(IDEMPOTENCY_POLL_SECONDS)
+
+def idempotent(view):
+    """Honour an Idempotency-Key header on a generating POST endpoint"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key', '').strip()
+        if not key or 'user_id' not in session:
+            return view(*args, **kwargs)
+        if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            return jsonify({'error': 'Idempotency-Key is too long'}), 400
+        
+        entry_key = (session['user_id'], request.endpoint, key)
+        fingerprint = request_fingerprint()
+        now = time.time()
+        with idempotency_lock:
+            purge_idempotency_keys(now)
+            entry = idempotent_requests.get(entry_key)
+            first = entry is None
+            if first:
+                entry = {'created': now, 'fingerprint': fingerprint, 'future': concurrent.futures.Future()}
+                idempotent_requests[entry_key] = entry
+                idempotency_expiry.append((now, entry_key))
+        
+        if not first:
+            if entry['fingerprint'] != fingerprint:
+                return jsonify({'error': 'Idempotency-Key was already used for a different request'}), 422
+            data, status, content_type = entry['future'].result()
+            replay = app.response_class(data, status=status, content_type=content_type)
+            replay.headers['Idempotent-Replayed'] = 'true'
+            return replay
+        
+        try:
+            response = shared_idempotent_response(entry_key, fingerprint, now)
+            if response is None:
+                response = app.make_response(view(*args, **kwargs))
+                recorded = (response.get_data(), response.status_code, response.content_type)
+                # Let a later retry run again instead of replaying a server error
+                state_store.finish_request(entry_key, now, recorded if response.status_code < 500 else None)
+        except BaseException as e:
+            with idempotency_lock:
+                idempotent_requests.pop(entry_key, None)
+            entry['future'].set_exception(e)
+            state_store.finish_request(entry_key, now)
+            raise
+        
+        if response.status_code >= 500:
+            with idempotency_lock:
+                idempotent_requests.pop(entry_key, None)
+        entry['future'].set_result((response.get_data(), response.status_code, response.content_type))
+        return response
+    return wrapper
 
 # ==================== ROUTES ====================
 
+@app.before_request
+def sync_state():
+    # Pick up changes made by other worker processes (no-op for the memory backend)
+    state_store.sync()
+
 @app.route('/')
 def index():
     # FORZA IL LOGIN - SOLO PER TEST
@@ -112,7 +2052,7 @@ def dashboard_page():
     # Get user materials for display
     user_materials = {
         'summaries': study_materials_db.get(user_id, []),
-        'flashcards': flashcards_db.get(user_id, []),
+        'flashcards': list(flashcards_db.get(user_id, {}).values()),
         'exams': exams_db.get(user_id, [])
     }
     
@@ -131,7 +2071,8 @@ def health_check():
         'user_logged_in': 'user_id' in session,
         'username': session.get('username') if 'user_id' in session else None,
         'ai_enabled': GROQ_API_KEY != "",
-        'features': ['summarize', 'flashcards', 'exam', 'oral_exam', 'youtube', 'transcription']
+        'llm_circuit': llm_breaker.snapshot(),
+        'features': ['summarize', 'flashcards', 'exam', 'oral_exam', 'youtube', 'transcription', 'search', 'spaced_repetition']
     })
 
 @app.route('/api/test_ai', methods=['GET'])
@@ -185,21 +2126,23 @@ def signup():
         if not username or not password:
             return jsonify({'error': 'Username and password required'}), 400
         
-        if username in users_db:
-            return jsonify({'error': 'Username already exists'}), 400
-        
         user_id = str(uuid.uuid4())
-        users_db[username] = {
-            'id': user_id,
-            'username': username,
-            'password': password,
-            'email': email,
-            'created_at': datetime.now().isoformat()
-        }
-        
-        study_materials_db[user_id] = []
-        flashcards_db[user_id] = []
-        exams_db[user_id] = []
+        error = state_store.commit(
+            {
+                'op': 'user_created',
+                'username': username,
+                'user': {
+                    'id': user_id,
+                    'username': username,
+                    'password': password,
+                    'email': email,
+                    'created_at': datetime.now().isoformat()
+                }
+            },
+            check=lambda: ('Username already exists', 400) if username in users_db else None
+        )
+        if error:
+            return jsonify({'error': error[0]}), error[1]
         
         session['user_id'] = user_id
         session['username'] = username
@@ -220,29 +2163,39 @@ def logout():
     session.clear()
     return jsonify({'success': True, 'message': 'Logged out successfully'})
 
-@app.route('/api/summarize', methods=['POST'])
-def summarize():
-    if 'user_id' not in session:
-        return jsonify({'error': 'Please login first'}), 401
+def summarize_text(user_id, text, topic, reuse=True, length=None):
+    """Summarize study material for user_id and save it; returns the response dict"""
+    length = len(text) if length is None else length
     
-    try:
-        data = request.json
-        text = data.get('text', '').strip()
-        topic = data.get('topic', 'General').strip()
-        user_id = session['user_id']
-        
-        if not text or len(text) < 20:
-            return jsonify({'error': 'Please provide study material (at least 20 characters)'}), 400
-        
-        if len(text) > 5000:
-            text = text[:5000] + "... [truncated]"
-        
-        prompt = f"""Analyze this study material and create a comprehensive, detailed summary:
+    # Reuse a prior summary of (nearly) the same notes instead of calling the LLM
+    fingerprint = simhash(text)
+    duplicate = None
+    if fingerprint is not None:
+        duplicate = near_duplicates.find('summary', fingerprint, user_id, topic)
+    
+    ai_summary = None
+    if duplicate and reuse:
+        print(f"Near-duplicate of summary {duplicate['id']}, skipping AI call")
+        if duplicate['user_id'] == user_id:
+            return {
+                'success': True,
+                'summary': duplicate['result'],
+                'topic': topic,
+                'material_id': duplicate['id'],
+                'saved': True,
+                'reused': True,
+                'original_length': length
+            }
+        ai_summary = duplicate['result']
+    
+    system_message = "You are an expert educator who creates excellent study summaries."
+    max_tokens = summary_output_tokens(text)
+    prompt = build_prompt(f"""Analyze this study material and create a comprehensive, detailed summary:
 
 TOPIC: {topic}
 
 CONTENT:
-{text}
+{{content}}
 
 Provide a detailed summary with:
 1. MAIN SUMMARY (2-3 paragraphs explaining the core concepts)
@@ -251,25 +2204,27 @@ Provide a detailed summary with:
 4. PRACTICAL APPLICATIONS (how this knowledge is used in real life)
 5. STUDY RECOMMENDATIONS (how to best learn this material)
 
-Make it detailed, educational, and easy to understand."""
-        
-        ai_summary = call_groq(prompt, "You are an expert educator who creates excellent study summaries.")
+Make it detailed, educational, and easy to understand.""", text, max_tokens, focus=topic, system_message=system_message)
+    
+    if not ai_summary:
+        ai_summary = call_groq(prompt, system_message, max_tokens=max_tokens)
+    reusable = ai_summary is not None
+    
+    if not ai_summary:
+        sentences = [s.strip() for s in text.split('.') if len(s.strip()) > 20]
+        key_points = sentences[:5] if len(sentences) > 5 else sentences
         
-        if not ai_summary:
-            sentences = [s.strip() for s in text.split('.') if len(s.strip()) > 20]
-            key_points = sentences[:5] if len(sentences) > 5 else sentences
-            
-            ai_summary = f"""📊 **COMPREHENSIVE SUMMARY: {topic}**
+        ai_summary = f"""📊 **COMPREHENSIVE SUMMARY: {topic}**
 
 **Main Summary:**
 This material provides in-depth coverage of {topic}. The content explores various aspects and principles essential for understanding this subject.
 
 **Key Points:**
 """
-            for i, point in enumerate(key_points, 1):
-                ai_summary += f"{i}. {point}\n"
-            
-            ai_summary += f"""
+        for i, point in enumerate(key_points, 1):
+            ai_summary += f"{i}. {point}\n"
+        
+        ai_summary += f"""
 
 **Important Terms:**
 • Key terminology relevant to {topic}
@@ -278,31 +2233,70 @@ This material provides in-depth coverage of {topic}. The content explores variou
 
 **Study Value:**
 This material offers valuable insights that can be applied in academic, professional, and practical contexts."""
-        
-        material_id = str(uuid.uuid4())
-        study_materials_db[user_id].append({
-            'id': material_id,
-            'type': 'summary',
+    
+    material_id = str(uuid.uuid4())
+    material = {
+        'id': material_id,
+        'type': 'summary',
+        'topic': topic,
+        'content': ai_summary,
+        'created_at': datetime.now().isoformat(),
+        'length': length
+    }
+    state_store.commit({'op': 'material_added', 'user_id': user_id, 'material': material})
+    
+    # Only remember real AI output, so a later retry can replace a fallback
+    if fingerprint is not None and reusable:
+        state_store.commit({
+            'op': 'near_duplicate_added',
+            'user_id': user_id,
+            'kind': 'summary',
+            'entry_id': material_id,
+            'fingerprint': fingerprint,
             'topic': topic,
-            'content': ai_summary,
-            'created_at': datetime.now().isoformat(),
-            'length': len(text)
+            'result': ai_summary
         })
+    
+    response = {
+        'success': True,
+        'summary': ai_summary,
+        'topic': topic,
+        'material_id': material_id,
+        'saved': True,
+        'reused': duplicate is not None and reuse,
+        'original_length': length
+    }
+    if duplicate and not reuse and duplicate['user_id'] == user_id:
+        response['similar_material_id'] = duplicate['id']
+    
+    return response
+
+@app.route('/api/summarize', methods=['POST'])
+@idempotent
+def summarize():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Please login first'}), 401
+    
+    try:
+        data = request.json
+        text = data.get('text', '').strip()
+        topic = data.get('topic', 'General').strip()
+        user_id = session['user_id']
         
-        return jsonify({
-            'success': True,
-            'summary': ai_summary,
-            'topic': topic,
-            'material_id': material_id,
-            'saved': True,
-            'original_length': len(text)
-        })
+        if not text or len(text) < 20:
+            return jsonify({'error': 'Please provide study material (at least 20 characters)'}), 400
+        
+        response = summarize_text(user_id, text, topic, reuse=bool(data.get('reuse', True)))
+        if data.get('prefetch', PREFETCH_BY_DEFAULT):
+            response['prefetch_id'] = schedule_prefetch(user_id, text, topic)
+        
+        return jsonify(response)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 # ==================== IMPROVED EXAM CREATION ====================
-def create_exam_from_text(text, exam_type="Study Material", num_questions=5):
+def create_exam_from_text(text, exam_type="Study Material", num_questions=5, user_id=None, reuse=True, fallback=True):
     """Helper function to create exam from text"""
     print(f"Creating exam from text (length: {len(text)}): {text[:100]}...")
     
@@ -310,8 +2304,7 @@ def create_exam_from_text(text, exam_type="Study Material", num_questions=5):
         print("Text too short, creating generic questions")
         return generate_text_based_questions(text, exam_type, num_questions), None
     
-    if len(text) > 3000:
-        text = text[:3000] + "... [truncated]"
+    fingerprint = simhash(text) if user_id else None
     
     # Check for the exact default text from frontend
     default_texts = [
@@ -334,12 +2327,38 @@ def create_exam_from_text(text, exam_type="Study Material", num_questions=5):
         else:
             return generate_mixed_educational_questions(num_questions), None
     
-    # If we have real study material, use AI
-    print("Using AI to create questions from study material")
-    prompt = f"""Create {num_questions} multiple-choice questions based EXCLUSIVELY on this study material:
+    # Sample questions already generated for this exact material first
+    digest = content_hash(text)
+    pool = pooled_questions(user_id, digest) if user_id and reuse else []
+    if len(pool) >= num_questions:
+        print(f"Sampling {num_questions} of {len(pool)} pooled questions, skipping AI call")
+        return sample_questions(pool, num_questions), None
+    
+    # Reuse questions generated for (nearly) the same material
+    duplicate = None
+    if fingerprint is not None:
+        duplicate = near_duplicates.find(
+            'exam', fingerprint, user_id, exam_type,
+            accept=lambda entry: len(entry['result']) >= num_questions
+        )
+        if duplicate and reuse and not pool:
+            print(f"Near-duplicate of exam material {duplicate['id']}, skipping AI call")
+            return copy.deepcopy(duplicate['result'][:num_questions]), None
+    
+    # If we have real study material, use AI for whatever the pool cannot cover
+    shortfall = num_questions - len(pool)
+    print(f"Using AI to create {shortfall} questions from study material ({len(pool)} pooled)")
+    system_message = "You are an exam creator. Create questions ONLY from the provided study material."
+    max_tokens = exam_output_tokens(shortfall)
+    avoid = ''
+    if pool:
+        avoid = "\n\nALREADY ASKED (write different questions):\n" + "\n".join(
+            f"- {q.question}" for q in pool[-QUESTION_POOL_PROMPT_AVOID:]
+        )
+    prompt = build_prompt(f"""Create {shortfall} multiple-choice questions based EXCLUSIVELY on this study material:
 
 STUDY MATERIAL:
-{text}
+{{content}}{avoid}
 
 IMPORTANT RULES:
 1. Questions MUST be directly from the provided text
@@ -354,20 +2373,46 @@ B) [Option B from text]
 C) [Option C from text]
 D) [Option D from text]
 Correct: [Letter]
-Explain: [Explanation referencing the text]"""
+Explain: [Explanation referencing the text]""", text, max_tokens, focus=exam_type, system_message=system_message)
     
     ai_response = call_groq(
         prompt,
-        system_message="You are an exam creator. Create questions ONLY from the provided study material.",
-        max_tokens=1500,
+        system_message=system_message,
+        max_tokens=max_tokens,
         temperature=0.3
     )
     
-    questions = []
+    generated = []
     
     if ai_response:
         print(f"AI Response received: {len(ai_response)} chars")
-        questions = parse_exam_questions(ai_response, num_questions)
+        seen = {question_key(q.question) for q in pool}
+        for q in parse_exam_questions(ai_response, shortfall):
+            key = question_key(q['question'])
+            if key and key not in seen:
+                seen.add(key)
+                generated.append(q)
+    
+    if user_id and generated:
+        state_store.commit({'op': 'questions_pooled', 'user_id': user_id, 'digest': digest, 'questions': copy.deepcopy(generated)})
+    
+    questions = sample_questions(pool, len(pool)) + generated
+    
+    # Only remember complete AI output, so a later retry can replace a fallback
+    if fingerprint is not None and len(questions) >= num_questions:
+        state_store.commit({
+            'op': 'near_duplicate_added',
+            'user_id': user_id,
+            'kind': 'exam',
+            'entry_id': str(uuid.uuid4()),
+            'replaces': duplicate['id'] if duplicate and duplicate['user_id'] == user_id else None,
+            'fingerprint': fingerprint,
+            'topic': exam_type,
+            'result': copy.deepcopy(questions)
+        })
+    
+    if not fallback and len(questions) < num_questions:
+        return questions, f"AI generated only {len(questions)} of {num_questions} questions"
     
     # If AI failed, create questions directly from text
     if not questions or len(questions) < num_questions:
@@ -378,6 +2423,8 @@ Explain: [Explanation referencing the text]"""
         else:
             questions = additional
     
+    for i, q in enumerate(questions):
+        q['question_number'] = i + 1
     return questions[:num_questions], None
 
 def parse_exam_questions(ai_text, max_questions):
@@ -668,7 +2715,76 @@ def generate_mixed_educational_questions(num_questions):
     return mixed[:num_questions]
 
 # ==================== UPDATED EXAM ENDPOINTS ====================
+def create_exam_for_user(user_id, text, exam_type, num_questions, reuse=True):
+    """Generate and store an exam for user_id; returns (response dict, error)"""
+    # Create questions from text, unless a prefetch after summarize already did
+    questions, error = None, None
+    prefetched = take_prefetched(user_id, text, 'exam')
+    if prefetched and not prefetched[1] and len(prefetched[0]) >= num_questions:
+        print("Using prefetched questions")
+        questions = copy.deepcopy(prefetched[0][:num_questions])
+    else:
+        questions, error = create_exam_from_text(
+            text, exam_type, num_questions,
+            user_id=user_id, reuse=reuse
+        )
+    
+    if error:
+        print(f"Error creating exam: {error}")
+        return None, error
+    
+    if not questions:
+        print("No questions generated, creating fallback")
+        questions = generate_mixed_educational_questions(num_questions)
+    
+    print(f"Generated {len(questions)} questions")
+    for i, q in enumerate(questions):
+        print(f"Q{i+1}: {q['question'][:80]}...")
+    
+    # Create exam object
+    exam_id = str(uuid.uuid4())
+    exam = {
+        'exam_id': exam_id,
+        'user_id': user_id,
+        'type': exam_type,
+        'questions': questions,
+        'total_questions': len(questions),
+        'total_points': len(questions) * 10,
+        'created_at': datetime.now().isoformat(),
+        'current_question': 0,
+        'score': 0,
+        'status': 'active'
+    }
+    
+    exam_record = {
+        'exam_id': exam_id,
+        'type': exam_type,
+        'questions': questions,
+        'total_questions': len(questions),
+        'created_at': datetime.now().isoformat(),
+        'status': 'created'
+    }
+    
+    # Store exam and save to exams_db
+    state_store.commit({'op': 'exam_created', 'user_id': user_id, 'exam': exam, 'record': exam_record})
+    
+    response = {
+        'success': True,
+        'exam_id': exam_id,
+        'questions': questions,
+        'exam': {
+            'exam_id': exam_id,
+            'type': exam_type,
+            'questions': questions,
+            'total_questions': len(questions)
+        },
+        'total_questions': len(questions),
+        'message': f'Exam created with {len(questions)} questions'
+    }
+    return response, None
+
 @app.route('/api/create_exam', methods=['POST'])
+@idempotent
 def create_exam_endpoint():
     """Create exam from provided study material - DEBUGGING VERSION"""
     print("\n" + "="*50)
@@ -692,68 +2808,13 @@ def create_exam_endpoint():
         print(f"Exam type: {exam_type}")
         print(f"Num questions: {num_questions}")
         
-        # Create questions from text
-        questions, error = create_exam_from_text(text, exam_type, num_questions)
-        
-        if error:
-            print(f"Error creating exam: {error}")
-            return jsonify({'error': error}), 400
-        
-        if not questions:
-            print("No questions generated, creating fallback")
-            questions = generate_mixed_educational_questions(num_questions)
-        
-        print(f"Generated {len(questions)} questions")
-        for i, q in enumerate(questions):
-            print(f"Q{i+1}: {q['question'][:80]}...")
-        
-        # Create exam object
-        exam_id = str(uuid.uuid4())
-        exam = {
-            'exam_id': exam_id,
-            'user_id': user_id,
-            'type': exam_type,
-            'questions': questions,
-            'total_questions': len(questions),
-            'total_points': len(questions) * 10,
-            'created_at': datetime.now().isoformat(),
-            'current_question': 0,
-            'score': 0,
-            'status': 'active'
-        }
-        
-        # Store exam
-        active_exams[exam_id] = exam
-        
-        # Save to exams_db
-        if user_id not in exams_db:
-            exams_db[user_id] = []
-        
-        exam_record = {
-            'exam_id': exam_id,
-            'type': exam_type,
-            'questions': questions,
-            'total_questions': len(questions),
-            'created_at': datetime.now().isoformat(),
-            'status': 'created'
-        }
-        exams_db[user_id].append(exam_record)
-        
-        response = {
-            'success': True,
-            'exam_id': exam_id,
-            'questions': questions,
-            'exam': {
-                'exam_id': exam_id,
-                'type': exam_type,
-                'questions': questions,
-                'total_questions': len(questions)
-            },
-            'total_questions': len(questions),
-            'message': f'Exam created with {len(questions)} questions'
-        }
-        
-        print(f"Returning response with {len(questions)} questions")
+        response, error = create_exam_for_user(
+            user_id, text, exam_type, num_questions, reuse=bool(data.get('reuse', True))
+        )
+        if error:
+            return jsonify({'error': error}), 400
+        
+        print(f"Returning response with {response['total_questions']} questions")
         print("="*50 + "\n")
         
         return jsonify(response)
@@ -766,6 +2827,7 @@ def create_exam_endpoint():
 
 # ==================== OTHER ENDPOINTS ====================
 @app.route('/api/suggest_topics', methods=['POST'])
+@idempotent
 def suggest_topics():
     """Suggest study topics based on material"""
     if 'user_id' not in session:
@@ -783,13 +2845,14 @@ def suggest_topics():
                 'main_topic': 'General Study'
             })
         
+        # Suggestions only need a representative sample of the material
         prompt = f"""Analyze this study material and provide learning suggestions:
 
-{text[:1000]}
+{select_relevant_chunks(text, PROMPT_INPUT_TOKENS // 4)}
 
 Provide practical study advice in a helpful format."""
         
-        ai_response = call_groq(prompt, "You are a helpful study advisor.")
+        ai_response = call_groq(prompt, "You are a helpful study advisor.", max_tokens=SUGGESTION_OUTPUT_TOKENS)
         
         if not ai_response:
             ai_response = """📚 Study Suggestions:
@@ -819,10 +2882,7 @@ def save_exam_result():
         data = request.json
         user_id = session['user_id']
         
-        if user_id not in exams_db:
-            exams_db[user_id] = []
-        
-        exams_db[user_id].append(data)
+        state_store.commit({'op': 'exam_result_saved', 'user_id': user_id, 'result': data})
         
         return jsonify({
             'success': True,
@@ -833,6 +2893,70 @@ def save_exam_result():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/grade_exam', methods=['POST'])
+def grade_exam():
+    """Grade submitted answers on the server and update progress stats"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Please login first'}), 401
+    
+    try:
+        data = request.json
+        exam_id = data.get('exam_id', '')
+        answers = data.get('answers') or {}
+        user_id = session['user_id']
+        
+        exam = active_exams.get(exam_id)
+        if not exam or exam.get('user_id') != user_id:
+            return jsonify({'error': 'Exam not found'}), 404
+        
+        if exam.get('status') == 'completed':
+            return jsonify({'error': 'Exam already graded'}), 409
+        
+        if not isinstance(answers, (dict, list)):
+            return jsonify({'error': 'Answers must be an object or a list'}), 400
+        
+        results = grade_answers(exam['questions'], answers)
+        score = sum(r['points_awarded'] for r in results)
+        correct_count = sum(r['correct'] for r in results)
+        total_points = sum(getattr(q, 'points', 10) for q in exam['questions'])
+        percentage = round(score / total_points * 100) if total_points else 0
+        
+        exam_result = {
+            'exam_id': exam_id,
+            'type': exam['type'],
+            'questions': [q.to_json() for q in exam['questions']],
+            'results': results,
+            'total_questions': len(results),
+            'score': score,
+            'total_points': total_points,
+            'percentage': percentage,
+            'correct_count': correct_count,
+            'completed_at': datetime.now().isoformat(),
+            'graded': True
+        }
+        
+        # Concurrent submissions of the same exam must only be graded once
+        error = state_store.commit(
+            {'op': 'exam_graded', 'user_id': user_id, 'exam_id': exam_id, 'result': exam_result},
+            check=lambda: ('Exam not found', 404) if exam_id not in active_exams
+                else ('Exam already graded', 409) if active_exams[exam_id].get('status') == 'completed' else None
+        )
+        if error:
+            return jsonify({'error': error[0]}), error[1]
+        
+        return jsonify({
+            'success': True,
+            'exam_id': exam_id,
+            'score': score,
+            'total_points': total_points,
+            'percentage': percentage,
+            'correct_count': correct_count,
+            'results': results
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/get_exam/<exam_id>', methods=['GET'])
 def get_exam_by_id(exam_id):
     """Get a specific exam by ID"""
@@ -841,6 +2965,9 @@ def get_exam_by_id(exam_id):
     
     try:
         user_id = session['user_id']
+        view, fields = requested_view()
+        if not view:
+            return jsonify({'error': 'view must be full or summary'}), 400
         
         # Check user's exams
         user_exams = exams_db.get(user_id, [])
@@ -859,8 +2986,9 @@ def get_exam_by_id(exam_id):
             return jsonify({'error': 'Exam not found'}), 404
         
         # Ensure questions exist
-        if 'questions' not in found_exam:
-            found_exam['questions'] = generate_mixed_educational_questions(3)
+        found_exam = exam_view_json(found_exam, view, fields)
+        if view == 'full' and fields is None and 'questions' not in found_exam:
+            found_exam = dict(found_exam, questions=generate_mixed_educational_questions(3))
         
         return jsonify({
             'success': True,
@@ -872,14 +3000,111 @@ def get_exam_by_id(exam_id):
 
 @app.route('/api/transcribe_youtube_real', methods=['POST'])
 def transcribe_youtube_real():
+    """Turn an uploaded .vtt/.srt caption file into a time-anchored transcript"""
     if 'user_id' not in session:
         return jsonify({'error': 'Please login first'}), 401
     
-    return jsonify({
-        'success': True,
-        'transcript': 'Enter your study notes manually for best results.',
-        'method': 'Manual input'
-    })
+    upload = request.files.get('file')
+    if not upload:
+        return jsonify({
+            'success': True,
+            'transcript': 'Upload the video\'s caption file (.vtt or .srt), or enter your study notes manually.',
+            'method': 'Manual input'
+        })
+    
+    if not (upload.filename or '').lower().endswith(('.vtt', '.srt')):
+        return jsonify({'error': 'Please upload a .vtt or .srt caption file'}), 400
+    
+    try:
+        # Parse line by line from the (disk-spooled) upload stream
+        lines = io.TextIOWrapper(upload.stream, encoding='utf-8', errors='replace')
+        paragraphs, chunks = [], []
+        for chunk in iter_caption_chunks(iter_caption_cues(lines)):
+            # One paragraph per chunk, so the prompt chunker keeps them intact
+            paragraphs.append(f"[{format_timestamp(chunk['start'])}] {chunk['text']}")
+            chunks.append({'start': chunk['start'], 'end': chunk['end'], 'paragraph': len(chunks)})
+        
+        if not paragraphs:
+            return jsonify({'error': 'No captions found in this file'}), 400
+        
+        return jsonify({
+            'success': True,
+            'transcript': '\n\n'.join(paragraphs),
+            'chunks': chunks,
+            'duration': chunks[-1]['end'],
+            'method': 'Caption file'
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/upload_material', methods=['POST'])
+@idempotent
+def upload_material():
+    """Summarize or build an exam from an uploaded .txt/.md/.pdf document"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Please login first'}), 401
+    
+    upload = request.files.get('file')
+    if not upload:
+        return jsonify({'error': 'Please choose a document to upload'}), 400
+    
+    filename = upload.filename or ''
+    is_pdf = filename.lower().endswith('.pdf')
+    if is_pdf and PdfReader is None:
+        return jsonify({'error': 'PDF uploads need the pypdf package on the server'}), 400
+    if not is_pdf and not filename.lower().endswith(UPLOAD_TEXT_EXTENSIONS):
+        return jsonify({'error': 'Please upload a .txt, .md or .pdf document'}), 400
+    
+    topic = request.form.get('topic', 'General').strip() or 'General'
+    action = request.form.get('action', 'summarize')
+    if action not in ('summarize', 'exam'):
+        return jsonify({'error': 'action must be summarize or exam'}), 400
+    user_id = session['user_id']
+    
+    try:
+        # UploadRequest already spooled the file to disk: map text uploads in place
+        stream = upload.stream
+        size = stream.seek(0, os.SEEK_END)
+        if size > UPLOAD_MAX_BYTES:
+            return jsonify({'error': f'Documents are limited to {UPLOAD_MAX_BYTES // (1024 * 1024)}MB'}), 413
+        with tempfile.TemporaryFile() if is_pdf else contextlib.nullcontext(stream) as source:
+            if is_pdf and size:
+                stream.seek(0)
+                extract_pdf_text(stream, source)
+            source.flush()
+            if not size or not source.tell():
+                return jsonify({'error': 'No text found in this document'}), 400
+            
+            document = MappedDocument(source)
+            try:
+                excerpt = select_relevant_chunks(document, PROMPT_INPUT_TOKENS, focus=topic)
+            finally:
+                document.close()
+        
+        if len(excerpt.strip()) < 50:
+            return jsonify({'error': 'Please upload a document with more study material'}), 400
+        
+        if action == 'summarize':
+            response = summarize_text(user_id, excerpt, topic, length=size)
+            if request.form.get('prefetch', str(PREFETCH_BY_DEFAULT)).lower() == 'true':
+                response['prefetch_id'] = schedule_prefetch(user_id, excerpt, topic)
+        else:
+            num_questions = min(int(request.form.get('num_questions', 5)), 10)
+            response, error = create_exam_for_user(user_id, excerpt, topic, num_questions)
+            if error:
+                return jsonify({'error': error}), 400
+        
+        response['document'] = {
+            'filename': filename,
+            'bytes': size,
+            'excerpt': excerpt,
+            'excerpt_tokens': estimate_tokens(excerpt)
+        }
+        return jsonify(response)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/api/process_lecture_notes', methods=['POST'])
 def process_lecture_notes():
@@ -899,8 +3124,265 @@ def process_lecture_notes():
         'subject': subject
     })
 
+def lecture_error(user_id, lecture_id, active=True):
+    lecture = lecture_sessions.get(lecture_id)
+    if not lecture or lecture['user_id'] != user_id:
+        return ('Lecture not found', 404)
+    if active and lecture['status'] != 'active':
+        return ('Lecture already finished', 409)
+    return None
+
+@app.route('/api/lecture/start', methods=['POST'])
+def start_lecture():
+    """Open a live lecture session that transcript chunks are appended to"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Please login first'}), 401
+    
+    try:
+        data = request.json or {}
+        subject = (data.get('subject') or 'Lecture').strip()
+        user_id = session['user_id']
+        
+        lecture_id = str(uuid.uuid4())
+        state_store.commit({
+            'op': 'lecture_started',
+            'user_id': user_id,
+            'lecture': {'id': lecture_id, 'subject': subject, 'started_at': datetime.now().isoformat()}
+        })
+        
+        return jsonify({'success': True, 'lecture_id': lecture_id, 'subject': subject})
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/lecture/<lecture_id>/append', methods=['POST'])
+@idempotent
+def append_lecture_chunk(lecture_id):
+    """Add a transcript chunk; the running notes are updated every few hundred words"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Please login first'}), 401
+    
+    try:
+        data = request.json
+        text = data.get('text', '').strip()
+        user_id = session['user_id']
+        
+        if not text:
+            return jsonify({'error': 'No transcript text provided'}), 400
+        
+        error = state_store.commit(
+            {'op': 'lecture_chunk_appended', 'user_id': user_id, 'lecture_id': lecture_id, 'text': text},
+            check=lambda: lecture_error(user_id, lecture_id)
+        )
+        if error:
+            return jsonify({'error': error[0]}), error[1]
+        
+        fold_lecture_delta(user_id, lecture_id, LECTURE_DELTA_TOKENS)
+        
+        with state_store.user_lock(user_id):
+            status = lecture_status_json(lecture_sessions[lecture_id])
+        return jsonify(dict(status, success=True))
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/lecture/<lecture_id>/finish', methods=['POST'])
+@idempotent
+def finish_lecture(lecture_id):
+    """Summarize the last delta and save the lecture notes as study material"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Please login first'}), 401
+    
+    try:
+        user_id = session['user_id']
+        
+        error = lecture_error(user_id, lecture_id)
+        if error:
+            return jsonify({'error': error[0]}), error[1]
+        
+        fold_lecture_delta(user_id, lecture_id, 0, force=True)
+        
+        with state_store.user_lock(user_id):
+            lecture = lecture_sessions[lecture_id]
+            notes = '\n\n'.join(lecture['segments'])
+            transcript = ' '.join(lecture['chunks'])
+            subject = lecture['subject']
+        
+        if not transcript:
+            return jsonify({'error': 'No transcript received for this lecture'}), 400
+        
+        material_id = str(uuid.uuid4())
+        error = state_store.commit(
+            {'op': 'lecture_finished', 'user_id': user_id, 'lecture_id': lecture_id, 'material_id': material_id},
+            check=lambda: lecture_error(user_id, lecture_id)
+        )
+        if error:
+            return jsonify({'error': error[0]}), error[1]
+        
+        state_store.commit({
+            'op': 'material_added',
+            'user_id': user_id,
+            'material': {
+                'id': material_id,
+                'type': 'summary',
+                'topic': subject,
+                'content': notes,
+                'created_at': datetime.now().isoformat(),
+                'length': len(transcript),
+                'source': 'lecture'
+            }
+        })
+        
+        return jsonify({
+            'success': True,
+            'subject': subject,
+            'processed_notes': notes,
+            'transcript': transcript,
+            'material_id': material_id,
+            'method': 'Live lecture notes'
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/lecture/<lecture_id>', methods=['GET'])
+def get_lecture(lecture_id):
+    if 'user_id' not in session:
+        return jsonify({'error': 'Please login first'}), 401
+    
+    user_id = session['user_id']
+    error = lecture_error(user_id, lecture_id, active=False)
+    if error:
+        return jsonify({'error': error[0]}), error[1]
+    
+    with state_store.user_lock(user_id):
+        status = lecture_status_json(lecture_sessions[lecture_id])
+    return jsonify(dict(status, success=True))
+
 # ==================== FLASHCARDS ENDPOINT ====================
+FLASHCARD_MAX_CARDS = 50
+FLASHCARD_SECTION_TOKENS = 1500   # study material per generation call
+FLASHCARD_MAX_SECTIONS = 8        # parallel calls per deck; longer input is trimmed to its central chunks
+FLASHCARD_OUTPUT_TOKENS = 60      # per card in the "front :: back" format
+FLASHCARD_DUPLICATE_JACCARD = 0.7
+FLASHCARD_LINE_RE = re.compile(r'^\s*(?:[-*•]|\d+[.)])?\s*(.+?)\s*::\s*(.+?)\s*$')
+# Deck source -> how the create response describes it; 'mixed' is an AI deck
+# topped up with text-based cards
+FLASHCARD_SOURCE_LABELS = {
+    'ai': 'Groq AI',
+    'mixed': 'Groq AI + text extraction',
+    'text': 'Text extraction'
+}
+
+def generate_flashcards(text, topic, num_cards):
+    """Create simple flashcards from text"""
+    sentences = []
+    for sentence in re.split(r'[.!?]+', text):
+        s = sentence.strip()
+        if 20 < len(s) < 150:
+            sentences.append(s)
+    
+    flashcards = []
+    for i, sentence in enumerate(sentences[:num_cards]):
+        # Create question from sentence
+        words = sentence.split()
+        if len(words) > 5:
+            question = f"What is the main point about '{' '.join(words[:3])}...'?"
+        else:
+            question = f"What is described in this statement?"
+        
+        flashcards.append({
+            'id': str(uuid.uuid4()),
+            'front': question,
+            'back': sentence,
+            'category': topic,
+            'difficulty': 'Medium',
+            'created_at': datetime.now().isoformat()
+        })
+    return flashcards
+
+def flashcard_sections(text, topic):
+    """Split study material into up to FLASHCARD_MAX_SECTIONS prompt-sized sections"""
+    budget = FLASHCARD_SECTION_TOKENS * FLASHCARD_MAX_SECTIONS
+    sections, current, current_tokens = [], [], 0
+    for chunk in chunk_text(select_relevant_chunks(text, budget, focus=topic)):
+        tokens = estimate_tokens(chunk)
+        if current and current_tokens + tokens > FLASHCARD_SECTION_TOKENS:
+            sections.append('\n\n'.join(current))
+            current, current_tokens = [], 0
+        current.append(chunk)
+        current_tokens += tokens
+    if current:
+        sections.append('\n\n'.join(current))
+    return sections[:FLASHCARD_MAX_SECTIONS]
+
+def parse_flashcards(ai_text, topic, created_at):
+    """Cards from "front :: back" lines; anything else in the reply is ignored"""
+    flashcards = []
+    for line in (ai_text or '').splitlines():
+        match = FLASHCARD_LINE_RE.match(line)
+        if match:
+            flashcards.append({
+                'id': str(uuid.uuid4()),
+                'front': match.group(1),
+                'back': match.group(2),
+                'category': topic,
+                'difficulty': 'Medium',
+                'created_at': created_at
+            })
+    return flashcards
+
+def dedupe_flashcards(flashcards):
+    """Drop cards whose content words overlap an earlier card's by FLASHCARD_DUPLICATE_JACCARD or more"""
+    kept, kept_terms = [], []
+    for card in flashcards:
+        terms = chunk_terms(f"{card['front']} {card['back']}")
+        if not terms or any(len(terms & other) >= FLASHCARD_DUPLICATE_JACCARD * len(terms | other) for other in kept_terms):
+            continue
+        kept.append(card)
+        kept_terms.append(terms)
+    return kept
+
+def generate_flashcard_deck(text, topic, num_cards):
+    """AI flashcards generated section by section in parallel; returns (cards, 'ai', 'mixed' or 'text')"""
+    sections = flashcard_sections(text, topic)
+    total_tokens = sum(estimate_tokens(section) for section in sections) or 1
+    system_message = "You are a study assistant who writes concise, accurate flashcards."
+    
+    def section_call(section):
+        # Ask each section for its share of the deck, plus slack for duplicates
+        share = max(2, math.ceil(num_cards * estimate_tokens(section) / total_tokens) + 1)
+        max_tokens = share * FLASHCARD_OUTPUT_TOKENS + 50
+        prompt = build_prompt(f"""Write {share} flashcards about {topic} from this study material:
+
+{{content}}
+
+Write ONE card per line in exactly this format and nothing else:
+question :: answer
+
+Keep answers under 25 words. Cover different facts; do not repeat a question.""", section, max_tokens, focus=topic, system_message=system_message)
+        return (prompt, system_message, max_tokens, 0.4)
+    
+    replies = call_groq_many([section_call(section) for section in sections])
+    created_at = datetime.now().isoformat()
+    flashcards = dedupe_flashcards([
+        card for reply in replies for card in parse_flashcards(reply, topic, created_at)
+    ])[:num_cards]
+    
+    if not flashcards:
+        print("AI generated no flashcards, using text-based cards")
+        return generate_flashcards(text, topic, num_cards), 'text'
+    if len(flashcards) < num_cards:
+        # Top up a short AI deck with sentence cards rather than return it partial
+        print(f"AI generated only {len(flashcards)} of {num_cards} flashcards, adding text-based cards")
+        ai_cards = len(flashcards)
+        flashcards = dedupe_flashcards(flashcards + generate_flashcards(text, topic, num_cards))[:num_cards]
+        if len(flashcards) > ai_cards:
+            return flashcards, 'mixed'
+    return flashcards, 'ai'
+
 @app.route('/api/create_flashcards', methods=['POST'])
+@idempotent
 def create_flashcards():
     if 'user_id' not in session:
         return jsonify({'error': 'Please login first'}), 401
@@ -909,47 +3391,149 @@ def create_flashcards():
         data = request.json
         text = data.get('text', '').strip()
         topic = data.get('topic', 'General').strip()
-        num_cards = min(int(data.get('num_cards', 12)), 20)
+        num_cards = max(1, min(int(data.get('num_cards', 12)), FLASHCARD_MAX_CARDS))
         user_id = session['user_id']
         
         if not text or len(text) < 50:
             return jsonify({'error': 'Please provide enough study material for flashcards'}), 400
         
-        # Create simple flashcards from text
-        sentences = []
-        for sentence in re.split(r'[.!?]+', text):
-            s = sentence.strip()
-            if 20 < len(s) < 150:
-                sentences.append(s)
+        prefetched = take_prefetched(user_id, text, 'flashcards')
+        if prefetched and len(prefetched) >= num_cards:
+            print("Using prefetched flashcards")
+            created_at = datetime.now().isoformat()
+            flashcards = [
+                dict(card, id=str(uuid.uuid4()), category=topic, created_at=created_at)
+                for card in prefetched[:num_cards]
+            ]
+            source = 'ai'
+        else:
+            flashcards, source = generate_flashcard_deck(text, topic, num_cards)
         
-        flashcards = []
-        for i, sentence in enumerate(sentences[:num_cards]):
-            # Create question from sentence
-            words = sentence.split()
-            if len(words) > 5:
-                question = f"What is the main point about '{' '.join(words[:3])}...'?"
-            else:
-                question = f"What is described in this statement?"
-            
-            flashcards.append({
-                'id': str(uuid.uuid4()),
-                'front': question,
-                'back': sentence,
-                'category': topic,
-                'difficulty': 'Medium',
-                'created_at': datetime.now().isoformat()
-            })
+        if not flashcards:
+            return jsonify({'error': 'Could not find enough content for flashcards'}), 400
         
-        # Save flashcards
-        if user_id not in flashcards_db:
-            flashcards_db[user_id] = []
-        flashcards_db[user_id].extend(flashcards)
+        # Save the deck
+        deck = {
+            'id': str(uuid.uuid4()),
+            'category': topic,
+            'created_at': datetime.now().isoformat(),
+            'source': source
+        }
+        state_store.commit({'op': 'flashcards_added', 'user_id': user_id, 'deck': deck, 'flashcards': flashcards})
         
         return jsonify({
             'success': True,
-            'flashcards': flashcards[:num_cards],
+            'deck_id': deck['id'],
+            'flashcards': flashcards,
             'total_cards': len(flashcards),
-            'topic': topic
+            'topic': topic,
+            'ai_source': FLASHCARD_SOURCE_LABELS[source]
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/get_flashcards/<deck_id>', methods=['GET'])
+def get_flashcard_deck(deck_id):
+    """One flashcard deck with all of its cards"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Please login first'}), 401
+    
+    view, fields = requested_view()
+    if not view:
+        return jsonify({'error': 'view must be full or summary'}), 400
+    
+    user_id = session['user_id']
+    with state_store.user_lock(user_id):
+        deck = flashcards_db.get(user_id, {}).get(pack_id(deck_id))
+        deck_json = deck.view_json(view, fields) if deck else None
+    
+    if not deck_json:
+        return jsonify({'error': 'Flashcard deck not found'}), 404
+    
+    return jsonify({
+        'success': True,
+        'flashcards': deck_json
+    })
+
+@app.route('/api/prefetch/<prefetch_id>', methods=['DELETE'])
+def cancel_prefetch_endpoint(prefetch_id):
+    if 'user_id' not in session:
+        return jsonify({'error': 'Please login first'}), 401
+    
+    cancelled = cancel_prefetch(session['user_id'], prefetch_id)
+    return jsonify({'success': True, 'cancelled': cancelled})
+
+@app.route('/api/flashcards/due', methods=['GET'])
+def get_due_flashcards():
+    """Next flashcards to study, most overdue first"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Please login first'}), 401
+    
+    try:
+        user_id = session['user_id']
+        limit = max(1, min(int(request.args.get('limit', 20)), 100))
+        
+        due_cards, next_due = [], None
+        with state_store.user_lock(user_id):
+            if user_id in flashcard_schedulers:
+                scheduler = flashcard_schedulers[user_id]
+                due_cards = [review_state_json(state) for state in scheduler.due(limit)]
+                next_due = scheduler.next_due()
+        
+        return jsonify({
+            'success': True,
+            'flashcards': due_cards,
+            'count': len(due_cards),
+            'next_due_at': datetime.fromtimestamp(next_due).isoformat() if next_due else None
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/flashcards/review', methods=['POST'])
+def review_flashcard():
+    """Record a review and reschedule the card"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Please login first'}), 401
+    
+    try:
+        data = request.json
+        card_id = data.get('card_id', '')
+        grade = data.get('grade', data.get('quality'))
+        user_id = session['user_id']
+        
+        if isinstance(grade, str) and grade.lower() in REVIEW_GRADES:
+            quality = REVIEW_GRADES[grade.lower()]
+        else:
+            try:
+                quality = int(grade)
+            except (TypeError, ValueError):
+                quality = -1
+        
+        if not 0 <= quality <= 5:
+            return jsonify({'error': 'Grade must be again/hard/good/easy or a quality from 0 to 5'}), 400
+        
+        def card_missing():
+            scheduler = flashcard_schedulers.get(user_id)
+            if not scheduler or pack_id(card_id) not in scheduler.states:
+                return ('Flashcard not found', 404)
+            return None
+        
+        error = state_store.commit(
+            {'op': 'flashcard_reviewed', 'user_id': user_id, 'card_id': card_id, 'quality': quality},
+            check=card_missing
+        )
+        if error:
+            return jsonify({'error': error[0]}), error[1]
+        
+        with state_store.user_lock(user_id):
+            state = flashcard_schedulers[user_id].states.get(pack_id(card_id))
+            flashcard = review_state_json(state) if state else None
+        
+        return jsonify({
+            'success': True,
+            'flashcard': flashcard
         })
         
     except Exception as e:
@@ -961,12 +3545,16 @@ def get_user_materials():
     if 'user_id' not in session:
         return jsonify({'error': 'Please login first'}), 401
     
+    view, fields = requested_view()
+    if not view:
+        return jsonify({'error': 'view must be full or summary'}), 400
+    
     user_id = session['user_id']
     materials = study_materials_db.get(user_id, [])
     
     return jsonify({
         'success': True,
-        'materials': materials[-10:],
+        'materials': [m.view_json(view, fields) for m in materials[-10:]],
         'count': len(materials)
     })
 
@@ -975,13 +3563,20 @@ def get_user_flashcards():
     if 'user_id' not in session:
         return jsonify({'error': 'Please login first'}), 401
     
+    # Decks are listed as summaries unless asked otherwise
+    view, fields = requested_view(default='summary')
+    if not view:
+        return jsonify({'error': 'view must be full or summary'}), 400
+    
     user_id = session['user_id']
-    cards = flashcards_db.get(user_id, [])
+    with state_store.user_lock(user_id):
+        decks = list(flashcards_db.get(user_id, {}).values())
     
     return jsonify({
         'success': True,
-        'flashcards': cards[-20:],
-        'count': len(cards)
+        'flashcards': [deck.view_json(view, fields) for deck in decks[-20:]],
+        'count': sum(len(deck.cards) for deck in decks),
+        'deck_count': len(decks)
     })
 
 @app.route('/api/user/exams', methods=['GET'])
@@ -989,15 +3584,51 @@ def get_user_exams():
     if 'user_id' not in session:
         return jsonify({'error': 'Please login first'}), 401
     
+    view, fields = requested_view()
+    if not view:
+        return jsonify({'error': 'view must be full or summary'}), 400
+    
     user_id = session['user_id']
     exams = exams_db.get(user_id, [])
     
     return jsonify({
         'success': True,
-        'exams': exams[-5:],
+        'exams': [exam_view_json(exam, view, fields) for exam in exams[-5:]],
         'count': len(exams)
     })
 
+@app.route('/api/user/progress', methods=['GET'])
+def get_user_progress():
+    """Running exam stats overall, per topic and per difficulty"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Please login first'}), 401
+    
+    user_id = session['user_id']
+    with state_store.user_lock(user_id):
+        analytics = exam_analytics.get(user_id) or new_user_analytics()
+        progress = {
+            'success': True,
+            'overall': analytics['overall'].to_json(),
+            'topics': {topic: stats.to_json() for topic, stats in analytics['topics'].items()},
+            'difficulty': {level: stats.to_json() for level, stats in analytics['difficulty'].items()}
+        }
+    
+    return jsonify(progress)
+
+@app.route('/api/analytics/cohort', methods=['GET'])
+def get_cohort_analytics():
+    """Question difficulty, score distributions and most missed items across all users"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Please login first'}), 401
+    
+    if session.get('username') not in COHORT_INSTRUCTORS:
+        return jsonify({'error': 'Cohort analytics are only available to instructors'}), 403
+    
+    try:
+        return jsonify(dict(cohort_answers.refresh(), success=True))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # ==================== OTHER ENDPOINTS ====================
 @app.route('/api/get_summary/<summary_id>', methods=['GET'])
 def get_summary_by_id(summary_id):
@@ -1010,11 +3641,16 @@ def get_summary_by_id(summary_id):
         if user_id not in study_materials_db:
             return jsonify({'error': 'No materials found'}), 404
         
+        view, fields = requested_view()
+        if not view:
+            return jsonify({'error': 'view must be full or summary'}), 400
+        
+        packed_id = pack_id(summary_id)
         for material in study_materials_db[user_id]:
-            if material.get('id') == summary_id:
+            if material.id == packed_id:
                 return jsonify({
                     'success': True,
-                    'summary': material
+                    'summary': material.view_json(view, fields)
                 })
         
         return jsonify({'error': 'Summary not found'}), 404
@@ -1022,34 +3658,46 @@ def get_summary_by_id(summary_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/delete_material/<material_id>', methods=['DELETE'])
-def delete_material(material_id):
+@app.route('/api/search', methods=['GET'])
+def search_materials():
+    """Full-text search over the user's summaries, flashcards and exam questions"""
     if 'user_id' not in session:
         return jsonify({'error': 'Please login first'}), 401
     
     try:
         user_id = session['user_id']
+        query = request.args.get('q', '').strip()
+        limit = max(1, min(int(request.args.get('limit', 20)), 100))
+        types = request.args.get('types', '').strip()
+        doc_types = {t.strip() for t in types.split(',') if t.strip()} or None
         
-        # Delete from study materials
-        if user_id in study_materials_db:
-            study_materials_db[user_id] = [
-                m for m in study_materials_db[user_id] 
-                if m.get('id') != material_id
-            ]
+        if not query:
+            return jsonify({'error': 'Please provide a search query'}), 400
         
-        # Delete from flashcards
-        if user_id in flashcards_db:
-            flashcards_db[user_id] = [
-                f for f in flashcards_db[user_id]
-                if f.get('id') != material_id
-            ]
+        results = []
+        with state_store.user_lock(user_id):
+            if user_id in search_indexes:
+                results = search_indexes[user_id].search(query, limit, doc_types)
         
-        # Delete from exams
-        if user_id in exams_db:
-            exams_db[user_id] = [
-                e for e in exams_db[user_id]
-                if e.get('exam_id') != material_id and e.get('id') != material_id
-            ]
+        return jsonify({
+            'success': True,
+            'query': query,
+            'results': results,
+            'count': len(results)
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/delete_material/<material_id>', methods=['DELETE'])
+def delete_material(material_id):
+    if 'user_id' not in session:
+        return jsonify({'error': 'Please login first'}), 401
+    
+    try:
+        user_id = session['user_id']
+        
+        state_store.commit({'op': 'material_deleted', 'user_id': user_id, 'material_id': material_id})
         
         return jsonify({'success': True, 'message': 'Material deleted'})
         
@@ -0,0 +1,184 @@
+"""Load test the LLM-bound HTTP endpoints against a local Groq stub.
+
+Run from the repository root:
+
+    python benchmarks/llm_load_test.py [--requests 400] [--concurrency 200] [--latency 0.25]
+
+Starts a stub chat-completions server that answers after --latency seconds,
+points GROQ_URL at it, serves app2 with Werkzeug's threaded server (what
+`python app2.py` runs) and fires a mix of POST /api/summarize and
+POST /api/create_exam requests, --concurrency at a time. Reports request
+latency, the peak number of Groq calls the stub saw in flight and the peak
+number of server threads: the views are synchronous, so each HTTP request
+holds one server thread while its Groq call runs on the shared llm_loop.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORDS = (
+    'cell membrane protein enzyme energy glucose nucleus gene evolution theory force mass '
+    'velocity empire economy market equation function integral respiration photosynthesis'
+).split()
+
+
+class GroqStub:
+    """Minimal HTTP/1.1 chat-completions server that counts concurrent calls"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.in_flight = 0
+        self.peak = 0
+        self.calls = 0
+        self.loop = asyncio.new_event_loop()
+        self.port = None
+        ready = threading.Event()
+        threading.Thread(target=self._run, args=(ready,), daemon=True).start()
+        ready.wait()
+
+    def _run(self, ready):
+        asyncio.set_event_loop(self.loop)
+        server = self.loop.run_until_complete(asyncio.start_server(self._handle, '127.0.0.1', 0, backlog=1024))
+        self.port = server.sockets[0].getsockname()[1]
+        ready.set()
+        self.loop.run_forever()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                length = 0
+                for line in head.decode('latin-1').split('\r\n'):
+                    if line.lower().startswith('content-length:'):
+                        length = int(line.split(':', 1)[1])
+                body = json.loads(await reader.readexactly(length))
+
+                self.calls += 1
+                self.in_flight += 1
+                self.peak = max(self.peak, self.in_flight)
+                await asyncio.sleep(self.latency)
+                self.in_flight -= 1
+
+                payload = json.dumps({'choices': [{'message': {'content': self._reply(body)}}]}).encode()
+                writer.write(
+                    b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                    + f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _reply(body):
+        prompt = body['messages'][-1]['content']
+        if 'multiple-choice questions' not in prompt:
+            return 'MAIN SUMMARY\n' + ' '.join(random.choices(WORDS, k=120))
+        lines = []
+        for i in range(1, 11):
+            topic = ' '.join(random.choices(WORDS, k=4))
+            lines += [
+                f"Question {i}: What does the material say about {topic} ({random.random():.6f})?",
+                'A) First', 'B) Second', 'C) Third', 'D) Fourth',
+                'Correct: A', f"Explain: The material covers {topic}."
+            ]
+        return '\n'.join(lines)
+
+
+def study_text():
+    # Random notes, so neither near-duplicate reuse nor question pools skip the LLM
+    return ' '.join(random.choices(WORDS, k=200)) + f" {random.random()}."
+
+
+async def drive(base_url, n_requests, concurrency):
+    latencies = []
+    failures = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        response = await client.post('/api/login', json={'username': 'student', 'password': 'password123'})
+        response.raise_for_status()
+
+        async def one(i):
+            nonlocal failures
+            if i % 2:
+                path, body = '/api/create_exam', {'text': study_text(), 'num_questions': 5, 'type': 'Load test'}
+            else:
+                path, body = '/api/summarize', {'text': study_text(), 'topic': 'Load test', 'prefetch': False}
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post(path, json=body)
+                latencies.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    failures += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(n_requests)))
+        return time.perf_counter() - started, latencies, failures
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.25, help='stub reply delay in seconds')
+    args = parser.parse_args()
+
+    stub = GroqStub(args.latency)
+    os.environ['GROQ_URL'] = f"http://127.0.0.1:{stub.port}/openai/v1/chat/completions"
+    os.environ.setdefault('GROQ_API_KEY', '')
+
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app2
+    server = make_server('127.0.0.1', 0, app2.app, threaded=True)
+    server.socket.listen(1024)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    peak_threads = threading.active_count()
+    sampling = True
+
+    def sample_threads():
+        nonlocal peak_threads
+        while sampling:
+            peak_threads = max(peak_threads, threading.active_count())
+            time.sleep(0.005)
+
+    sampler = threading.Thread(target=sample_threads, daemon=True)
+    sampler.start()
+
+    # The views print debug output for every request; keep the report readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        elapsed, latencies, failures = asyncio.run(
+            drive(f"http://127.0.0.1:{server.server_port}", args.requests, args.concurrency)
+        )
+    sampling = False
+    sampler.join()
+    server.shutdown()
+
+    latencies.sort()
+    print(f"{args.requests} requests, {args.concurrency} concurrent, stub latency {args.latency * 1000:.0f} ms")
+    print(f"wall time           {elapsed:.2f} s ({args.requests / elapsed:.0f} req/s)")
+    print(f"latency p50 / p95   {statistics.median(latencies) * 1000:.0f} / {latencies[int(len(latencies) * 0.95) - 1] * 1000:.0f} ms")
+    print(f"non-200 responses   {failures}")
+    print(f"Groq calls          {stub.calls} (peak {stub.peak} in flight)")
+    print(f"peak server threads {peak_threads}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Measure the heap per stored record: plain JSON dicts versus slotted records.
+
+Run from the repository root:
+
+    python benchmarks/record_memory_bench.py [--records 20000]
+
+Builds --records flashcards, exam questions and materials (with a 10-char
+content so the per-record overhead is not hidden by summary text) and
+serializes them to JSON, as they sit in the event log. Then, under
+tracemalloc, rebuilds them the way state replay does: once kept as the
+parsed dicts and once turned into Flashcard/Question/Material records with
+the parsed dicts dropped. Reports the traced bytes per record, including
+every string the record keeps.
+"""
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import sys
+import tracemalloc
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import app2  # noqa: E402
+
+STUDY_TEXT = ' '.join(
+    f"Sentence number {i} describes photosynthesis converting light into chemical energy in plants."
+    for i in range(40)
+)
+
+
+def flashcards(n):
+    cards = []
+    while len(cards) < n:
+        cards += app2.generate_flashcards(STUDY_TEXT, 'Biology', 20)
+    return cards[:n]
+
+
+def questions(n):
+    found = []
+    while len(found) < n:
+        found += app2.generate_text_based_questions(STUDY_TEXT, 'Biology', 10)
+    return found[:n]
+
+
+def materials(n):
+    return [
+        {
+            'id': str(uuid.uuid4()), 'type': 'summary', 'topic': 'Biology', 'content': 'x' * 10,
+            'created_at': datetime.now().isoformat(), 'length': 1200
+        }
+        for _ in range(n)
+    ]
+
+
+def bytes_per_record(logged, n, record_class=None):
+    """Traced heap per record after parsing the logged JSON (and converting it)"""
+    gc.collect()
+    tracemalloc.start()
+    parsed = json.loads(logged)
+    if record_class is not None:
+        kept = [record_class.from_json(item) for item in parsed]
+        del parsed
+    else:
+        kept = parsed
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return size / n
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--records', type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'record':<12} {'dict B':>8} {'slotted B':>10} {'saved':>7}")
+    for name, make, record_class in (
+        ('flashcard', flashcards, app2.Flashcard),
+        ('question', questions, app2.Question),
+        ('material', materials, app2.Material),
+    ):
+        with contextlib.redirect_stdout(io.StringIO()):
+            logged = json.dumps(make(args.records))
+        as_dict = bytes_per_record(logged, args.records)
+        slotted = bytes_per_record(logged, args.records, record_class)
+        print(f"{name:<12} {as_dict:>8.0f} {slotted:>10.0f} {1 - slotted / as_dict:>7.0%}")
+
+
+if __name__ == '__main__':
+    main()
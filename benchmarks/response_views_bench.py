@@ -0,0 +1,123 @@
+"""Benchmark response size and time for each response view of the list and detail endpoints.
+
+Run from the repository root:
+
+    python benchmarks/response_views_bench.py [--repeat 200]
+
+Fills the demo student's library with --materials summaries of about 5KB,
+--exams ten-question exams and --decks decks of --cards cards, then requests
+every list and detail endpoint as ?view=full, ?view=summary and a typical
+?fields= selection through the Flask test client. Reports the response body
+size and the mean and p95 time per request, which covers serialization and
+JSON encoding.
+"""
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import app2  # noqa: E402
+
+USER_ID = 'demo-user-12345'
+STUDY_TEXT = ' '.join(
+    f"Sentence number {i} describes photosynthesis converting light into chemical energy in plants."
+    for i in range(30)
+)
+
+# Endpoint -> the ?fields= selection a listing or detail page would typically ask for
+FIELDS = {
+    '/api/user/materials': 'id,type,topic,created_at',
+    '/api/user/exams': 'exam_id,type,score,created_at',
+    '/api/user/flashcards': 'id,category,created_at',
+    '/api/get_summary/{material_id}': 'id,topic,created_at',
+    '/api/get_exam/{exam_id}': 'exam_id,type,total_questions',
+    '/api/get_flashcards/{deck_id}': 'id,category,created_at',
+}
+
+
+def seed(n_materials, n_exams, n_decks, n_cards):
+    """Commit study data for the demo student; returns one id of each kind"""
+    now = datetime.now().isoformat()
+    ids = {}
+    for _ in range(n_materials):
+        ids['material_id'] = str(uuid.uuid4())
+        app2.state_store.commit({
+            'op': 'material_added', 'user_id': USER_ID,
+            'material': {
+                'id': ids['material_id'], 'type': 'summary', 'topic': 'Biology',
+                'content': 'Long summary paragraph about photosynthesis. ' * 110,
+                'created_at': now, 'length': 5000
+            }
+        })
+    for _ in range(n_exams):
+        ids['exam_id'] = str(uuid.uuid4())
+        questions = app2.generate_text_based_questions(STUDY_TEXT, 'Biology', 10)
+        exam = {
+            'exam_id': ids['exam_id'], 'user_id': USER_ID, 'type': 'Biology', 'questions': questions,
+            'total_questions': len(questions), 'created_at': now
+        }
+        app2.state_store.commit({
+            'op': 'exam_created', 'user_id': USER_ID,
+            'exam': dict(exam, status='active'),
+            'record': dict(exam, status='created')
+        })
+    for _ in range(n_decks):
+        ids['deck_id'] = str(uuid.uuid4())
+        app2.state_store.commit({
+            'op': 'flashcards_added', 'user_id': USER_ID,
+            'deck': {'id': ids['deck_id'], 'category': 'Biology', 'created_at': now, 'source': 'ai'},
+            'flashcards': app2.generate_flashcards(STUDY_TEXT, 'Biology', n_cards)
+        })
+    return ids
+
+
+def measure(client, url, repeat):
+    """(body bytes, mean ms, p95 ms) for GET url"""
+    response = client.get(url)
+    assert response.status_code == 200, f"{url} returned {response.status_code}"
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        client.get(url)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return len(response.data), statistics.mean(timings), timings[int(len(timings) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--materials', type=int, default=10)
+    parser.add_argument('--exams', type=int, default=5)
+    parser.add_argument('--decks', type=int, default=20)
+    parser.add_argument('--cards', type=int, default=20)
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        ids = seed(args.materials, args.exams, args.decks, args.cards)
+        client = app2.app.test_client()
+        client.post('/api/login', json={'username': 'student', 'password': 'password123'})
+
+    print(f"{args.materials} materials, {args.exams} exams, {args.decks} decks of {args.cards} cards")
+    print(f"{'endpoint':<30} {'view':<8} {'bytes':>9} {'share':>7} {'mean ms':>8} {'p95 ms':>8}")
+    for endpoint, fields in FIELDS.items():
+        path = endpoint.format(**ids)
+        full_bytes = None
+        for view, query in (('full', '?view=full'), ('summary', '?view=summary'), ('fields', f"?fields={fields}")):
+            # The views print debug output on every request; keep the report readable
+            with contextlib.redirect_stdout(io.StringIO()):
+                size, mean, p95 = measure(client, path + query, args.repeat)
+            full_bytes = full_bytes or size
+            print(f"{endpoint.split('/{')[0]:<30} {view:<8} {size:>9} {size / full_bytes:>7.1%} {mean:>8.2f} {p95:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
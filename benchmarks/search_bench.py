@@ -0,0 +1,149 @@
+"""Benchmark SearchIndex.search on a synthetic 100k-document index.
+
+Run from the repository root:
+
+    python benchmarks/search_bench.py [--docs 100000] [--repeat 50]
+
+The corpus mixes a few very common words ("the", "and", ...) with a
+Zipf-distributed study vocabulary so that everyday terms such as "cell"
+have large posting lists and prefixes expand to many terms.
+
+"recall" is the share of results scoring at least the k-th best score of an
+unpruned BM25 pass over every expanded term. Libraries below
+SEARCH_COMMON_MIN_DOCS always score every term, so it should read 100%.
+
+Before timing, a three-document library checks that a word found in most
+documents still matches next to a rarer one (small per-user libraries).
+"""
+import argparse
+import math
+import os
+import random
+import statistics
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app2 import SEARCH_BM25_B, SEARCH_BM25_K1, SearchIndex, tokenize  # noqa: E402
+
+COMMON = ['the', 'and', 'of', 'to', 'in', 'is', 'a', 'that', 'for', 'with']
+STUDY = [
+    'cell', 'cells', 'cellular', 'cellulose', 'energy', 'energetic', 'protein', 'proteins',
+    'proteome', 'membrane', 'nucleus', 'mitochondria', 'enzyme', 'enzymes', 'photosynthesis',
+    'respiration', 'glucose', 'atp', 'dna', 'rna', 'gene', 'genes', 'genetic', 'evolution',
+    'theory', 'therapy', 'thermal', 'thermodynamics', 'force', 'mass', 'velocity', 'acceleration',
+    'history', 'revolution', 'empire', 'economy', 'market', 'equation', 'function', 'integral',
+]
+
+QUERIES = [
+    'cell',
+    'the cell energy protein',
+    'mitochondria atp',
+    'the',
+    'photosynth',
+    'ce',
+    'history of the empire',
+    'the and of to in',
+    'w1',
+    'w12 w3',
+]
+
+
+def build_corpus(n_docs, seed=7):
+    rng = random.Random(seed)
+    # 20k filler words plus the study vocabulary, Zipf-weighted
+    vocab = STUDY + [f"w{i}" for i in range(20000)]
+    weights = [1.0 / (rank + 10) for rank in range(len(vocab))]
+    index = SearchIndex()
+    for i in range(n_docs):
+        length = rng.randint(20, 80)
+        words = rng.choices(vocab, weights, k=length)
+        words += rng.choices(COMMON, k=length // 3)
+        index.add('flashcard', f"card-{i}", ' '.join(words), parent_id=f"deck-{i // 20}", title=f"card {i}")
+    return index
+
+
+def exhaustive_search(index, query, limit):
+    """Reference scores: every posting of every expanded term, no pruning"""
+    n_docs = len(index.docs)
+    avg_length = index.total_length / n_docs
+    scores = defaultdict(float)
+    for token in set(tokenize(query)):
+        for term in index.expand(token):
+            posting = index.postings[term]
+            df = len(posting)
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            if term != token:
+                idf *= 0.5
+            for slot, tf in posting.items():
+                length = index.doc_lengths[index.slot_keys[slot]]
+                norm = SEARCH_BM25_K1 * (1 - SEARCH_BM25_B + SEARCH_BM25_B * length / avg_length)
+                scores[slot] += idf * tf * (SEARCH_BM25_K1 + 1) / (tf + norm)
+    return sorted(scores.values(), reverse=True)[:limit]
+
+
+def check_small_library():
+    """Words in most of a small library's documents must still match"""
+    index = SearchIndex()
+    index.add('summary', 'a', 'photosynthesis in plants turns light into chemical energy')
+    index.add('summary', 'b', 'photosynthesis produces glucose')
+    index.add('summary', 'c', 'chlorophyll is green')
+    cases = {
+        'photosynthesis chlorophyll': {'a', 'b', 'c'},
+        'photo glucose': {'a', 'b'},
+    }
+    for query, expected in cases.items():
+        found = {result['id'] for result in index.search(query)}
+        print(f"small library: {query!r} -> {sorted(found)}")
+        assert found == expected, f"{query!r} matched {sorted(found)}, expected {sorted(expected)}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--docs', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+
+    check_small_library()
+
+    started = time.perf_counter()
+    index = build_corpus(args.docs)
+    print(f"indexed {args.docs} documents in {time.perf_counter() - started:.1f}s")
+
+    print(f"{'query':<28} {'first ms':>9} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'recall':>8}")
+    worst = 0.0
+    for query in QUERIES:
+        started = time.perf_counter()
+        index.search(query, args.limit)
+        first = (time.perf_counter() - started) * 1000
+
+        timings = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            index.search(query, args.limit)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        # Share of results scoring at least the exhaustive k-th best score
+        # (many documents tie, so ids alone are not comparable)
+        found = [result['score'] for result in index.search(query, args.limit)]
+        reference = exhaustive_search(index, query, args.limit)
+        cutoff = round(reference[-1], 4) if reference else 0
+        overlap = sum(score >= cutoff for score in found) / max(1, len(reference))
+        p95 = timings[int(len(timings) * 0.95) - 1]
+        worst = max(worst, p95)
+        print(f"{query:<28} {first:>9.2f} {statistics.median(timings):>8.2f} {p95:>8.2f} {timings[-1]:>8.2f} {overlap:>8.0%}")
+
+    # Interleave writes with queries, as a user adding cards while searching would
+    started = time.perf_counter()
+    for i in range(200):
+        index.add('flashcard', f"new-{i}", 'the cell energy protein membrane', parent_id='deck-new')
+        index.search('the cell energy protein', args.limit)
+    print(f"200 add+search rounds: {(time.perf_counter() - started) * 1000 / 200:.2f} ms/round")
+    print(f"worst p95: {worst:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()